@@ -1,29 +1,120 @@
-from transformers import pipeline
+from onnx_backend import load_pipeline
+from agents.simple_classifier import SimpleClassifierAgent
+import os
 import re
+import threading
 
 class ClassifierAgent:
-    def __init__(self):
+    def __init__(self, mode=None, margin=None):
+        # "cascade" tries the keyword scorer first and only escalates ambiguous
+        # queries to the zero-shot model, "zero-shot" always uses the model
+        self.mode = mode or os.getenv("CLASSIFIER_MODE", "cascade")
+        if self.mode not in ("cascade", "zero-shot"):
+            raise ValueError(f"Unknown classifier mode: {self.mode}")
+        # Minimum lead of the top keyword score over the runner-up to skip the model
+        self.margin = margin if margin is not None else float(os.getenv("CLASSIFIER_MARGIN", "1"))
+        self.candidate_labels = ["billing", "technical", "general"]
+        self.keyword_classifier = SimpleClassifierAgent()
+
+        self._classifier = None
+        self._classifier_lock = threading.Lock()
+        if self.mode == "zero-shot":
+            self._classifier = self.load_zero_shot()
+
+    def load_zero_shot(self):
         # Use a smaller, faster model for classification
-        self.classifier = pipeline(
+        # CPU only; INFERENCE_BACKEND=onnx serves an int8 ONNX export instead of PyTorch
+        return load_pipeline(
             "zero-shot-classification",
-            model="facebook/bart-large-mnli",
-            device=-1  # Use CPU (-1) instead of GPU (0)
+            model="facebook/bart-large-mnli"
         )
-    
+
+    @property
+    def classifier(self):
+        # In cascade mode the model is only loaded once a query needs it
+        if self._classifier is None:
+            with self._classifier_lock:
+                if self._classifier is None:
+                    self._classifier = self.load_zero_shot()
+        return self._classifier
+
+    def keyword_category(self, query):
+        # Returns the keyword category if it is unambiguous, otherwise None
+        scores = self.keyword_classifier.score_query(query)
+        ranked = sorted(scores.values(), reverse=True)
+        top = ranked[0]
+        runner_up = ranked[1] if len(ranked) > 1 else 0
+        if top > 0 and top - runner_up >= self.margin:
+            return max(scores, key=scores.get)
+        return None
+
+    def fallback_category(self, query):
+        # Best keyword guess when the model can't answer in time
+        scores = self.keyword_classifier.score_query(query)
+        return max(scores, key=scores.get) if max(scores.values()) > 0 else "general"
+
+    def classify_inline(self, query):
+        # The keyword result when the cascade settles the query without the
+        # model, otherwise None so the caller runs the model off the request thread
+        if self.mode == "cascade":
+            category = self.keyword_category(query)
+            if category is not None:
+                return category, "keyword"
+        return None
+
     def classify_query(self, query):
+        return self.classify_with_tier(query)[0]
+
+    def classify_with_tier(self, query):
+        if self.mode == "cascade":
+            category = self.keyword_category(query)
+            if category is not None:
+                return category, "keyword"
+
         try:
-            # Define our categories
-            candidate_labels = ["billing", "technical", "general"]
-            
             # Classify the query
             result = self.classifier(
                 query,
-                candidate_labels,
+                self.candidate_labels,
                 hypothesis_template="This text is about {}."
             )
-            
+
             # Return the label with the highest score
-            return result['labels'][0]
+            return result['labels'][0], "zero-shot"
         except Exception as e:
             print(f"Error in classification: {e}")
-            return "general"  # Fallback category
\ No newline at end of file
+            return "general", "fallback"  # Fallback category
+
+    def classify_batch(self, queries):
+        return [category for category, _ in self.classify_batch_with_tier(queries)]
+
+    def classify_batch_with_tier(self, queries):
+        queries = list(queries)
+        results = [None] * len(queries)
+        if self.mode == "cascade":
+            for i, query in enumerate(queries):
+                category = self.keyword_category(query)
+                if category is not None:
+                    results[i] = (category, "keyword")
+
+        # Only the ambiguous queries go through the model, in one pipeline call
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        try:
+            # The pipeline batches the NLI forward passes over the whole list
+            outputs = self.classifier(
+                [queries[i] for i in pending],
+                self.candidate_labels,
+                hypothesis_template="This text is about {}."
+            )
+            if isinstance(outputs, dict):
+                outputs = [outputs]
+            for i, output in zip(pending, outputs):
+                results[i] = (output['labels'][0], "zero-shot")
+        except Exception as e:
+            print(f"Error in batch classification: {e}")
+            for i in pending:
+                results[i] = ("general", "fallback")
+        return results
@@ -1,36 +1,64 @@
 from langchain.llms import HuggingFacePipeline
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings import HuggingFaceEmbeddings, CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.vectorstores import FAISS
 from langchain.schema import Document
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+import hashlib
 import json
+import os
+import shutil
+import tempfile
+import threading
 import torch
+import numpy as np
+from faq_index import normalize_rows
+from file_lock import file_lock
+from retrieval import retriever_from_env
+from agents.streaming import stream_generate
+from onnx_backend import load_pipeline
+
+RESPONSE_TEMPLATE = "Based on the following context from our knowledge base, draft a helpful response to the customer query. Be professional and helpful.\n\nContext:\n{context}\n\nQuery: {query}\n\nResponse:"
 
 class ResponseAgent:
     def __init__(self):
         # Setup a local LLM for response generation
         model_name = "microsoft/DialoGPT-medium"  # Smaller model that can run on CPU
         
+        # Shared by the pipeline and by token streaming
+        self.generation_kwargs = {
+            "max_length": 200,
+            "do_sample": True,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "pad_token_id": 50256  # Specific to GPT models
+        }
+        
         # Initialize the text generation pipeline
         self.llm = self.setup_local_llm(model_name)
         self.embeddings = HuggingFaceEmbeddings()
-        self.vectorstore = self.setup_knowledge_base()
+        # Document embeddings are cached on disk per text, so only new or
+        # changed FAQ entries are ever re-embedded
+        self.cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+            self.embeddings,
+            LocalFileStore('knowledge_base/embedding_cache'),
+            namespace=self.embeddings.model_name
+        )
+        self.faq_path = 'knowledge_base/faq.json'
+        self.index_root = 'knowledge_base/faiss_index'
+        self.reload_lock = threading.Lock()
+        self.vectorstore, self.answers, self.knowledge_base_version = self.setup_knowledge_base()
+        self.retriever = self.setup_retriever(self.vectorstore, self.knowledge_base_version)
     
     def setup_local_llm(self, model_name):
         try:
             # Use a smaller model that can run on CPU
-            text_gen_pipeline = pipeline(
+            text_gen_pipeline = load_pipeline(
                 "text-generation",
                 model=model_name,
                 tokenizer=model_name,
-                device=-1,  # Use CPU
-                max_length=200,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.9,
-                pad_token_id=50256  # Specific to GPT models
+                **self.generation_kwargs
             )
             
             return HuggingFacePipeline(pipeline=text_gen_pipeline)
@@ -39,50 +67,245 @@ class ResponseAgent:
             return None
     
     def setup_knowledge_base(self):
+        # Returns (vectorstore, set of FAQ answers, version)
         try:
             # Load FAQ knowledge base
-            with open('knowledge_base/faq.json', 'r') as f:
-                faq_data = json.load(f)
-            
-            # Create documents for vector store
-            documents = []
-            for category, qa_pairs in faq_data.items():
-                for qa in qa_pairs:
-                    doc_text = f"Category: {category}. Question: {qa['question']}. Answer: {qa['answer']}"
-                    documents.append(Document(page_content=doc_text, metadata={"category": category}))
+            with open(self.faq_path, 'rb') as f:
+                raw = f.read()
+            faq_data = json.loads(raw)
+            answers = {qa['answer'] for qa_pairs in faq_data.values() for qa in qa_pairs}
             
-            return FAISS.from_documents(documents, self.embeddings)
+            # A saved index is reused as long as the FAQ and embedding model are unchanged
+            index_key = hashlib.sha256(self.embeddings.model_name.encode('utf-8') + b'\0' + raw).hexdigest()[:16]
+            index_path = os.path.join(self.index_root, index_key)
+            # Loading holds the lock shared and building holds it exclusively,
+            # so no process reads an index while another replaces or prunes it
+            os.makedirs(self.index_root, exist_ok=True)
+            lock_path = os.path.join(self.index_root, '.lock')
+            with file_lock(lock_path, shared=True):
+                vectorstore = self.load_index(index_path)
+            if vectorstore is None:
+                with file_lock(lock_path):
+                    # Another process may have saved it while this one waited
+                    vectorstore = self.load_index(index_path)
+                    if vectorstore is None:
+                        vectorstore = self.build_index(faq_data)
+                        self.save_index(vectorstore, index_path)
+            return vectorstore, answers, index_key
         except Exception as e:
             print(f"Error setting up knowledge base: {e}")
             # Return an empty vector store if there's an error
-            return FAISS.from_documents([Document(page_content="Fallback content", metadata={"category": "general"})], self.embeddings)
+            fallback_store = FAISS.from_documents([Document(page_content="Fallback content", metadata={"category": "general"})], self.embeddings)
+            return fallback_store, set(), None
+    
+    def load_index(self, index_path):
+        if not os.path.isdir(index_path):
+            return None
+        try:
+            return FAISS.load_local(index_path, self.cached_embeddings)
+        except Exception as e:
+            print(f"Error loading saved index, rebuilding: {e}")
+            return None
+    
+    def build_index(self, faq_data):
+        # Create documents for vector store
+        documents = []
+        for category, qa_pairs in faq_data.items():
+            for qa in qa_pairs:
+                doc_text = f"Category: {category}. Question: {qa['question']}. Answer: {qa['answer']}"
+                documents.append(Document(page_content=doc_text, metadata={"category": category}))
+        
+        # Entries already in the embedding cache are not embedded again
+        return FAISS.from_documents(documents, self.cached_embeddings)
+    
+    def reload_knowledge_base(self):
+        # Rebuilds the index from the current FAQ file. Only added or edited
+        # entries miss the embedding cache, so only those are embedded. Queries
+        # keep using the old index until the new one is complete.
+        with self.reload_lock:
+            previous_version = self.knowledge_base_version
+            previous_docs = self.document_texts(self.vectorstore)
+            vectorstore, answers, version = self.setup_knowledge_base()
+            if version is None:
+                raise ValueError("Could not load the knowledge base, keeping the current one")
+            if version == previous_version:
+                return {"reloaded": False, "version": version}
+            
+            retriever = self.setup_retriever(vectorstore, version, previous=self.retriever)
+            docs = self.document_texts(vectorstore)
+            # Swapped together in a single statement once everything is built
+            self.vectorstore, self.retriever, self.answers, self.knowledge_base_version = \
+                vectorstore, retriever, answers, version
+            return {
+                "reloaded": True,
+                "version": version,
+                "entries": len(docs),
+                "embedded": len(docs - previous_docs),
+                "removed": len(previous_docs - docs)
+            }
+    
+    def document_texts(self, vectorstore):
+        return {vectorstore.docstore.search(doc_id).page_content for doc_id in vectorstore.index_to_docstore_id.values()}
+    
+    def setup_retriever(self, vectorstore, version, previous=None):
+        # Regroup the stored vectors by category so each category gets its own
+        # ANN index, with a global index for categories that have no entries.
+        # The ANN indexes are saved inside the FAISS directory of this version,
+        # so they are built once per knowledge base rather than once per process.
+        index = vectorstore.index
+        docs = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in range(index.ntotal)]
+        vectors = index.reconstruct_n(0, index.ntotal)
+        
+        rows_by_category = {}
+        for i, doc in enumerate(docs):
+            rows_by_category.setdefault(doc.metadata.get("category"), []).append(i)
+        
+        order = []
+        offsets = {}
+        for category, rows in rows_by_category.items():
+            offsets[category] = (len(order), len(order) + len(rows))
+            order.extend(rows)
+        
+        matrix = normalize_rows(vectors[order]) if order else np.zeros((0, 0), dtype=np.float32)
+        ordered_docs = [docs[i] for i in order]
+        saving = {}
+        if version is not None:
+            saving = {
+                "save_prefix": os.path.join(self.index_root, version, 'ann'),
+                "version": version,
+                "lock_path": os.path.join(self.index_root, '.lock')
+            }
+        return retriever_from_env(matrix, offsets, ordered_docs, previous=previous,
+                                  texts=[doc.page_content for doc in ordered_docs], **saving)
     
-    def generate_response(self, query, category):
+    def save_index(self, vectorstore, index_path):
+        # Call with the index lock held exclusively
         try:
-            # Search for similar questions in knowledge base
-            similar_docs = self.vectorstore.similarity_search(query, k=3)
+            # Save under a unique temporary name and rename, so a partial index is never loaded
+            tmp_path = tempfile.mkdtemp(dir=self.index_root, prefix=os.path.basename(index_path) + '.', suffix='.tmp')
+            try:
+                os.chmod(tmp_path, 0o755)
+                vectorstore.save_local(tmp_path)
+                shutil.rmtree(index_path, ignore_errors=True)
+                os.replace(tmp_path, index_path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
             
-            # Filter by category if possible
-            category_docs = [doc for doc in similar_docs if doc.metadata.get("category") == category]
-            if category_docs:
-                similar_docs = category_docs
+            # Indexes for older versions of the FAQ, and leftovers of interrupted
+            # saves, are no longer needed; nobody can be reading them under the lock
+            for name in os.listdir(self.index_root):
+                if name != os.path.basename(index_path) and not name.startswith('.'):
+                    shutil.rmtree(os.path.join(self.index_root, name), ignore_errors=True)
+        except OSError as e:
+            print(f"Error saving index: {e}")
+    
+    def embed_query(self, query):
+        return normalize_rows(self.embeddings.embed_query(query))[0]
+    
+    def is_knowledge_base_answer(self, response):
+        # True for verbatim FAQ answers returned when no LLM is available
+        return response in self.answers
+    
+    def retrieve(self, query, query_embedding=None):
+        # Top documents for every category at once, so retrieval can overlap
+        # classification; the generation methods take the result as `retrieval`
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        categories = self.retriever.categories
+        results = self.retriever.search_batch(np.tile(query_embedding, (len(categories), 1)), categories, k=3,
+                                              query_texts=[query] * len(categories))
+        hits = {category: [doc for doc, _ in found] for category, found in zip(categories, results)}
+        return {"embedding": query_embedding, "hits": hits}
+    
+    def retrieved_docs(self, query, category, query_embedding=None, retrieval=None):
+        if retrieval is not None:
+            if category in retrieval["hits"]:
+                return retrieval["hits"][category]
+            query_embedding = retrieval["embedding"]
+        # Search the category's own index, falling back to the whole knowledge base
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        return [doc for doc, _ in self.retriever.search(query_embedding, category, k=3, query_text=query)]
+    
+    def generate_response(self, query, category, query_embedding=None, retrieval=None):
+        try:
+            similar_docs = self.retrieved_docs(query, category, query_embedding, retrieval)
+            return self.draft_from_docs(query, category, similar_docs)
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return "I apologize, but I'm experiencing technical difficulties. Please try again later or contact our support team directly at support@company.com."
+    
+    def generate_batch(self, queries, categories):
+        try:
+            # Embed every query in one call, then search by vector
+            query_embeddings = self.embeddings.embed_documents(list(queries))
+        except Exception as e:
+            print(f"Error embedding batch: {e}")
+            return [self.generate_response(query, category) for query, category in zip(queries, categories)]
+        
+        results = self.retriever.search_batch(normalize_rows(query_embeddings), list(categories), k=3,
+                                              query_texts=list(queries))
+        
+        responses = []
+        for query, category, hits in zip(queries, categories, results):
+            try:
+                similar_docs = [doc for doc, _ in hits]
+                responses.append(self.draft_from_docs(query, category, similar_docs))
+            except Exception as e:
+                print(f"Error generating response: {e}")
+                responses.append("I apologize, but I'm experiencing technical difficulties. Please try again later or contact our support team directly at support@company.com.")
+        return responses
+    
+    def fallback_response(self, query, category, query_embedding=None, retrieval=None):
+        # The top retrieved answer, without waiting for the LLM
+        try:
+            similar_docs = self.retrieved_docs(query, category, query_embedding, retrieval)
+            similar_docs, _ = self.build_context(category, similar_docs)
+            return self.knowledge_base_answer(similar_docs)
+        except Exception as e:
+            print(f"Error retrieving fallback response: {e}")
+            return "I apologize, but I don't have enough information to answer your question. Please contact our support team for assistance."
+    
+    def stream_response(self, query, category, query_embedding=None, retrieval=None, deadline=None):
+        # Past the deadline the stream ends early and generation stops
+        try:
+            similar_docs = self.retrieved_docs(query, category, query_embedding, retrieval)
+            similar_docs, context = self.build_context(category, similar_docs)
             
-            context = "\n".join([doc.page_content for doc in similar_docs])
+            if not self.llm:
+                yield self.knowledge_base_answer(similar_docs)
+                return
             
+            prompt = RESPONSE_TEMPLATE.format(query=query, context=context)
+            yield from stream_generate(self.llm.pipeline, prompt, deadline=deadline, **self.generation_kwargs)
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield "I apologize, but I'm experiencing technical difficulties. Please try again later or contact our support team directly at support@company.com."
+    
+    def build_context(self, category, similar_docs):
+        # Filter by category if possible
+        category_docs = [doc for doc in similar_docs if doc.metadata.get("category") == category]
+        if category_docs:
+            similar_docs = category_docs
+        
+        return similar_docs, "\n".join([doc.page_content for doc in similar_docs])
+    
+    def knowledge_base_answer(self, similar_docs):
+        # Fallback: return the most relevant answer from knowledge base
+        if similar_docs:
+            return similar_docs[0].page_content.split("Answer: ")[-1]
+        else:
+            return "I apologize, but I don't have enough information to answer your question. Please contact our support team for assistance."
+    
+    def draft_from_docs(self, query, category, similar_docs):
+        similar_docs, context = self.build_context(category, similar_docs)
+        
+        if self.llm:
             prompt = PromptTemplate(
                 input_variables=["query", "context"],
-                template="Based on the following context from our knowledge base, draft a helpful response to the customer query. Be professional and helpful.\n\nContext:\n{context}\n\nQuery: {query}\n\nResponse:"
+                template=RESPONSE_TEMPLATE
             )
-            
-            if self.llm:
-                chain = LLMChain(llm=self.llm, prompt=prompt)
-                return chain.run(query=query, context=context)
-            else:
-                # Fallback: return the most relevant answer from knowledge base
-                if similar_docs:
-                    return similar_docs[0].page_content.split("Answer: ")[-1]
-                else:
-                    return "I apologize, but I don't have enough information to answer your question. Please contact our support team for assistance."
-        except Exception as e:
-            print(f"Error generating response: {e}")
-            return "I apologize, but I'm experiencing technical difficulties. Please try again later or contact our support team directly at support@company.com."
\ No newline at end of file
+            chain = LLMChain(llm=self.llm, prompt=prompt)
+            return chain.run(query=query, context=context)
+        else:
+            return self.knowledge_base_answer(similar_docs)
@@ -1,28 +1,60 @@
 from langchain.llms import HuggingFacePipeline
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from transformers import pipeline
+from onnx_backend import load_pipeline
+from agents.streaming import stream_generate
+
+REVIEW_TEMPLATE = "Review this customer support response. Check for tone and correctness. Query: {query}. Category: {category}. Response: {response}. Improved response:"
+
+# Knowledge base answers are reviewed without the query, so one review serves every query they answer
+ANSWER_REVIEW_TEMPLATE = "Review this customer support answer from our knowledge base. Check for tone and correctness. Category: {category}. Response: {response}. Improved response:"
 
 class ReviewAgent:
     def __init__(self):
         # Use a smaller model for review
-        review_pipeline = pipeline(
+        self.generation_kwargs = {"max_length": 300}
+        self.review_pipeline = load_pipeline(
             "text2text-generation",
             model="google/flan-t5-small",
-            device=-1,  # Use CPU
-            max_length=300
+            **self.generation_kwargs
         )
-        self.llm = HuggingFacePipeline(pipeline=review_pipeline)
+        self.llm = HuggingFacePipeline(pipeline=self.review_pipeline)
     
     def review_response(self, query, category, response):
         try:
             prompt = PromptTemplate(
                 input_variables=["query", "category", "response"],
-                template="Review this customer support response. Check for tone and correctness. Query: {query}. Category: {category}. Response: {response}. Improved response:"
+                template=REVIEW_TEMPLATE
             )
             
             chain = LLMChain(llm=self.llm, prompt=prompt)
             return chain.run(query=query, category=category, response=response)
         except Exception as e:
             print(f"Error in review: {e}")
-            return response  # Return the original response if review fails
\ No newline at end of file
+            return response  # Return the original response if review fails
+    
+    def review_answer(self, category, response):
+        try:
+            prompt = PromptTemplate(
+                input_variables=["category", "response"],
+                template=ANSWER_REVIEW_TEMPLATE
+            )
+            
+            chain = LLMChain(llm=self.llm, prompt=prompt)
+            return chain.run(category=category, response=response)
+        except Exception as e:
+            print(f"Error in review: {e}")
+            return response
+    
+    def stream_review(self, query, category, response, deadline=None):
+        # Past the deadline the stream ends early and generation stops
+        try:
+            prompt = REVIEW_TEMPLATE.format(query=query, category=category, response=response)
+            yield from stream_generate(self.review_pipeline, prompt, deadline=deadline, **self.generation_kwargs)
+        except Exception as e:
+            print(f"Error in review: {e}")
+            yield response  # Return the original response if review fails
+    
+    def review_batch(self, queries, categories, responses):
+        return [self.review_response(query, category, response)
+                for query, category, response in zip(queries, categories, responses)]
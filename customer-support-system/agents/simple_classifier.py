@@ -1,3 +1,5 @@
+from keyword_matcher import KeywordMatcher
+
 class SimpleClassifierAgent:
     def __init__(self):
         self.keywords = {
@@ -5,15 +7,14 @@ class SimpleClassifierAgent:
             "technical": ["password", "login", "crash", "error", "bug", "feature", "update", "install", "technical", "reset", "2fa", "two factor"],
             "general": ["hours", "contact", "support", "help", "information", "about", "tutorial", "business hours", "phone", "email"]
         }
+        # Compiled once so every category is scored in a single pass over the query
+        self.matcher = KeywordMatcher(self.keywords)
+    
+    def score_query(self, query):
+        return self.matcher.score(query)
     
     def classify_query(self, query):
-        query_lower = query.lower()
-        scores = {category: 0 for category in self.keywords.keys()}
-        
-        for category, words in self.keywords.items():
-            for word in words:
-                if word in query_lower:
-                    scores[category] += 1
+        scores = self.score_query(query)
         
         # Return category with highest score, default to general
         return max(scores, key=scores.get) if max(scores.values()) > 0 else "general"
\ No newline at end of file
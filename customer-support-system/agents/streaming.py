@@ -0,0 +1,47 @@
+import queue
+import time
+from threading import Event, Thread
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+class StopOnEvent(StoppingCriteria):
+    # Ends generate() at its next token once the event is set
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+def stream_generate(text_pipeline, prompt, deadline=None, **generation_kwargs):
+    # Runs generate() on a background thread and yields decoded text as each
+    # token is produced, instead of waiting for the whole sequence. With a
+    # deadline (a time.time() value) the stream ends early when the next token
+    # doesn't arrive before it. However the stream ends, generate() stops with
+    # it rather than running on to max_length with nobody reading.
+    tokenizer = text_pipeline.tokenizer
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    inputs = tokenizer(prompt, return_tensors="pt")
+    stop = Event()
+    thread = Thread(
+        target=text_pipeline.model.generate,
+        kwargs=dict(inputs, streamer=streamer, stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]),
+                    **generation_kwargs),
+        daemon=True
+    )
+    thread.start()
+    try:
+        while True:
+            if deadline is not None:
+                # The streamer waits this long for each token
+                streamer.timeout = max(deadline - time.time(), 0)
+            try:
+                text = next(streamer)
+            except StopIteration:
+                break
+            except queue.Empty:
+                # Out of time; the caller sees the deadline has passed and falls back
+                return
+            if text:
+                yield text
+        thread.join()
+    finally:
+        stop.set()
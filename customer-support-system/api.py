@@ -1,9 +1,18 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from app import CustomerSupportSystem
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from worker_pool import PipelinePool, PoolSaturatedError, PoolNotReadyError
+from metrics import REGISTRY, REQUEST_SECONDS, REJECTED_TOTAL, record_batch, record_result
 import uvicorn
+import json
+import logging
+import os
+import time
 from fastapi.middleware.cors import CORSMiddleware
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
 app = FastAPI(title="Customer Support API", description="Multi-agent customer support system")
 
 # Add CORS middleware to allow requests from Streamlit
@@ -15,19 +24,163 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MAX_BATCH_SIZE = int(os.getenv("SUPPORT_MAX_BATCH", "1000"))
+
 class QueryRequest(BaseModel):
     query: str
+    # Optional latency budget; stages that would overrun it fall back to cheaper answers
+    deadline_ms: Optional[int] = Field(None, gt=0)
+
+def request_deadline(request):
+    if request.deadline_ms is None:
+        return None
+    return time.time() + request.deadline_ms / 1000.0
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., max_length=MAX_BATCH_SIZE)
+
+# The support system runs inside a bounded worker pool so the event loop
+# stays free for other requests and health checks. Models are loaded and
+# warmed up in the background once the server has started.
+support_pool = PipelinePool.from_env()
+
+def wants_timings(header_value):
+    return header_value is not None and header_value.lower() in ("1", "true", "yes")
+
+def finish_result(result, include_timings):
+    # Record metrics from the stage timings, and only return them to clients that asked
+    record_result(result)
+    return strip_timings(result, include_timings)
 
-# Initialize the support system
-support_system = CustomerSupportSystem()
+def strip_timings(result, include_timings):
+    timings = result.pop("timings", None)
+    if include_timings and timings is not None:
+        result["timings"] = timings
+    return result
+
+class ReservedStreamingResponse(StreamingResponse):
+    # Releases the pool slot even if the body is never iterated, e.g. when the
+    # client disconnects before the first chunk
+    def __init__(self, reservation, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reservation = reservation
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.reservation.release()
+
+def busy_response(error):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(error), "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+@app.on_event("startup")
+async def start_pool():
+    support_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    support_pool.shutdown()
 
 @app.post("/support/query")
-async def process_query(request: QueryRequest):
+async def process_query(request: QueryRequest, x_stage_timings: Optional[str] = Header(None)):
+    start = time.perf_counter()
     try:
-        result = support_system.process_query(request.query)
-        return result
+        result = await support_pool.run("process_query", request.query, with_timings=True,
+                                        deadline=request_deadline(request))
+        return finish_result(result, wants_timings(x_stage_timings))
+    except PoolSaturatedError as e:
+        REJECTED_TOTAL.inc("query")
+        return busy_response(e)
+    except PoolNotReadyError as e:
+        return busy_response(e)
     except Exception as e:
         return {"error": str(e), "category": "general", "response": "I apologize, but I'm experiencing technical difficulties. Please try again later."}
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, "query")
+
+@app.post("/support/query/batch")
+async def process_batch(request: BatchQueryRequest, x_stage_timings: Optional[str] = Header(None)):
+    start = time.perf_counter()
+    try:
+        results = await support_pool.run("process_batch", request.queries, with_timings=True)
+        record_batch(results)
+        include_timings = wants_timings(x_stage_timings)
+        return {"results": [strip_timings(result, include_timings) for result in results]}
+    except PoolSaturatedError as e:
+        REJECTED_TOTAL.inc("batch")
+        return busy_response(e)
+    except PoolNotReadyError as e:
+        return busy_response(e)
+    except Exception as e:
+        return {"error": str(e), "results": []}
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, "batch")
+
+@app.post("/support/query/stream")
+async def stream_query(request: QueryRequest):
+    # Server-sent events: "category", then "draft" tokens, then "final" tokens, then "done"
+    try:
+        reservation = support_pool.reserve()
+    except PoolSaturatedError as e:
+        REJECTED_TOTAL.inc("stream")
+        return busy_response(e)
+    except PoolNotReadyError as e:
+        return busy_response(e)
+    
+    async def events():
+        start = time.perf_counter()
+        try:
+            async for event, data in support_pool.stream(reservation, "stream_query", request.query,
+                                                         deadline=request_deadline(request)):
+                if event == "done":
+                    record_result(data)
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            reservation.release()
+            REQUEST_SECONDS.observe(time.perf_counter() - start, "stream")
+    
+    try:
+        return ReservedStreamingResponse(reservation, events(), media_type="text/event-stream",
+                                         headers={"Cache-Control": "no-cache"})
+    except Exception:
+        reservation.release()
+        raise
+
+@app.post("/admin/knowledge-base/reload")
+async def reload_knowledge_base(x_admin_token: Optional[str] = Header(None)):
+    # Re-reads knowledge_base/faq.json, embedding only added or edited entries
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and x_admin_token != admin_token:
+        return JSONResponse(status_code=403, content={"error": "Invalid admin token"})
+    if support_pool.mode == "process":
+        # A call reaches only one of the worker processes
+        return JSONResponse(status_code=409, content={
+            "error": "Process workers each hold their own index; set KB_WATCH_INTERVAL to reload them"
+        })
+    try:
+        return await support_pool.run("reload_knowledge_base")
+    except (PoolSaturatedError, PoolNotReadyError) as e:
+        return busy_response(e)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    try:
+        return await support_pool.run("cache_stats")
+    except (PoolSaturatedError, PoolNotReadyError) as e:
+        return busy_response(e)
 
 @app.get("/")
 async def root():
@@ -35,7 +188,18 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    # Liveness: the process is up and serving, whether or not the models are loaded
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    # Readiness: every agent is loaded and has served a warm-up pass
+    if support_pool.ready:
+        return {"status": "ready"}
+    content = {"status": "loading"}
+    if support_pool.load_error:
+        content = {"status": "failed", "error": support_pool.load_error}
+    return JSONResponse(status_code=503, content=content)
+
 if __name__ == "__main__":
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
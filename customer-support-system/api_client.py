@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SupportAPIClient:
+    # Keep-alive client for the support API with a circuit breaker. After
+    # failure_threshold failures in a row the circuit opens: calls fail at
+    # once instead of waiting out a timeout, and a background thread polls
+    # /ready until the API answers again and the circuit closes.
+    def __init__(self, base_url=None, failure_threshold=3, probe_interval=5.0, connect_timeout=1.0,
+                 read_timeout=5.0, pool_size=10):
+        self.base_url = (base_url or os.getenv("SUPPORT_API_URL", "http://localhost:8000")).rstrip("/")
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.timeout = (connect_timeout, read_timeout)
+        # One pooled session for every Streamlit session and rerun
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open = False
+        self.probing = False
+
+    @property
+    def available(self):
+        return not self.open
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold or self.open:
+                return
+            self.open = True
+            if self.probing:
+                return
+            self.probing = True
+        threading.Thread(target=self.probe, name="support-api-probe", daemon=True).start()
+
+    def probe(self):
+        # Runs while the circuit is open; closes it on the first ready answer
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                ready = self.session.get(f"{self.base_url}/ready", timeout=self.timeout).status_code == 200
+            except requests.RequestException:
+                ready = False
+            if ready:
+                with self.lock:
+                    self.failures = 0
+                    self.open = False
+                    self.probing = False
+                return
+
+    def stream_query(self, query, deadline_ms=None):
+        # Yields the (event, data) pairs of /support/query/stream. Yields
+        # nothing when the circuit is open or the API can't answer.
+        if self.open:
+            return
+        body = {"query": query}
+        if deadline_ms is not None:
+            body["deadline_ms"] = deadline_ms
+        try:
+            with self.session.post(f"{self.base_url}/support/query/stream", json=body, stream=True,
+                                   timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    self.record_failure()
+                    return
+                # Callers may stop reading at "done", so success is recorded up front
+                self.record_success()
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "done":
+                            # A response left partly unread closes its connection instead
+                            # of going back to the pool. Callers usually stop at "done", so
+                            # the rest of the body is drained before it is handed over.
+                            for _ in response.iter_lines():
+                                pass
+                        yield event, data
+        except (requests.RequestException, ValueError):
+            self.record_failure()
@@ -1,4 +1,31 @@
 from simple_agents import SimpleClassifierAgent, SimpleResponseAgent, SimpleReviewAgent
+from response_cache import ResponseCache, ReviewMemo, normalize_query
+from metrics import SampledLogger
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextlib
+import logging
+import os
+import threading
+import time
+
+STAGES = ("classify", "retrieve", "generate", "review")
+
+# "parallel" starts classification as soon as the exact cache misses and runs
+# the semantic lookup and retrieval while it is classifying; "sequential" runs
+# one stage after the other
+PIPELINE_MODES = ("parallel", "sequential")
+
+logger = SampledLogger(logging.getLogger(__name__), float(os.getenv("LOG_SAMPLE_RATE", "0.01")))
+
+# Synthetic queries run at startup so the first real request doesn't pay for
+# lazy model loading and first-call allocations. The last one has no keywords,
+# so a cascade classifier loads its zero-shot model too.
+WARM_UP_QUERIES = [
+    "How do I update my payment method?",
+    "The app keeps crashing when I open it",
+    "What are your business hours?",
+    "Hello, I have a question"
+]
 
 class CustomerSupportSystem:
     def __init__(self, use_simple=True):
@@ -15,24 +42,466 @@ class CustomerSupportSystem:
             self.classifier = ClassifierAgent()
             self.response_agent = ResponseAgent()
             self.review_agent = ReviewAgent()
+        
+        self.cache = ResponseCache.from_env()
+        self.review_memo = ReviewMemo(int(os.getenv("REVIEW_MEMO_SIZE", "10000")))
+        # Run stages that have a deadline, so the caller can stop waiting for
+        # them. Each stage has its own pool, so slow generations can't hold up
+        # classification or review.
+        stage_workers = int(os.getenv("STAGE_WORKERS", "8"))
+        self.stage_executors = {
+            stage: ThreadPoolExecutor(max_workers=stage_workers, thread_name_prefix=f"support-{stage}")
+            for stage in STAGES
+        }
+        # Abandoned stages keep their thread until they finish. Past this many
+        # per stage, the stage goes straight to its fallback rather than
+        # queueing behind them.
+        self.max_abandoned = int(os.getenv("MAX_ABANDONED_STAGES", str(max(stage_workers // 2, 1))))
+        self.abandoned = dict.fromkeys(STAGES, 0)
+        self.abandoned_lock = threading.Lock()
+        self.pipeline_mode = os.getenv("PIPELINE_MODE", "parallel")
+        if self.pipeline_mode not in PIPELINE_MODES:
+            raise ValueError(f"Unknown pipeline mode: {self.pipeline_mode}")
+    
+    def process_query(self, query, with_timings=False, deadline=None):
+        # deadline is an absolute time.time() value. Stages that can't finish
+        # before it are abandoned and replaced with their cheap fallback, and
+        # the result lists which stages fell back.
+        # Per-stage wall time in seconds, returned when with_timings is set
+        timings = {}
+        fallbacks = [] if deadline is not None else None
+        result = self._process_query(query, timings, deadline, fallbacks)
+        if fallbacks is not None:
+            result["fallbacks"] = fallbacks
+        logger.info("query_processed", category=result["category"], classifier_tier=result["classifier_tier"],
+                    cache=result.get("cache"), fallbacks=fallbacks, timings=timings)
+        if with_timings:
+            result["timings"] = timings
+        return result
+    
+    @property
+    def parallel(self):
+        return self.pipeline_mode == "parallel"
+    
+    def _lookup_cache(self, query, exact_only=False):
+        # Returns (cached result or None, lookup state needed to store the result
+        # later). With exact_only the semantic lookup is left to _lookup_semantic.
+        lookup = {"key": None, "embedding": None, "version": None}
+        if not self.cache:
+            return None, lookup
+        
+        lookup["version"] = self.response_agent.knowledge_base_version
+        self.cache.sync_version(lookup["version"])
+        lookup["key"] = normalize_query(query)
+        cached = self.cache.get_exact(lookup["key"])
+        if cached is not None:
+            return dict(cached, cache="exact"), lookup
+        if exact_only:
+            return None, lookup
+        return self._lookup_semantic(query, lookup), lookup
+    
+    def _lookup_semantic(self, query, lookup):
+        if not self.cache:
+            return None
+        if self.cache.semantic:
+            # The embedding used for the semantic lookup is reused for retrieval
+            lookup["embedding"] = self.response_agent.embed_query(query)
+            cached = self.cache.get_semantic(lookup["embedding"])
+            if cached is not None:
+                return dict(cached, cache="semantic")
+        else:
+            self.cache.record_miss()
+        return None
+    
+    def _start_classification(self, query, deadline):
+        # Classification needs neither the embedding nor the knowledge base, so
+        # it runs on its pool while this thread embeds and retrieves. The
+        # future's result is ((category, tier), seconds spent classifying).
+        # Keyword results are cheaper than a thread handoff, so they are
+        # computed here and only the model tier goes to the pool.
+        start = time.perf_counter()
+        classified = self.classifier.classify_inline(query)
+        if classified is not None:
+            future = Future()
+            future.set_result((classified, time.perf_counter() - start))
+            return future
+        
+        def run():
+            start = time.perf_counter()
+            return self.classifier.classify_with_tier(query), time.perf_counter() - start
+        if deadline is None:
+            # Without a budget there is no fallback, so it waits for a thread like any call
+            return self.stage_executors["classify"].submit(run)
+        if deadline <= time.time():
+            return None
+        return self._submit_stage("classify", run)
+    
+    def _lookup_and_retrieve(self, query, lookup):
+        # The semantic cache lookup, then the best matches in every category.
+        # Returns (cached result, query embedding, retrieval). Works on a copy
+        # of lookup, so a run abandoned at the deadline can't change it later.
+        scratch = dict(lookup)
+        cached = self._lookup_semantic(query, scratch)
+        if cached is not None:
+            return cached, scratch["embedding"], None
+        return None, scratch["embedding"], self.response_agent.retrieve(query, query_embedding=scratch["embedding"])
+    
+    def _store_result(self, result, lookup):
+        if not self.cache:
+            return result
+        self.cache.put(lookup["key"], lookup["embedding"], result, lookup["version"])
+        return dict(result, cache="miss")
+    
+    def _run_stage(self, stage, deadline, fallbacks, run, fallback):
+        if deadline is None:
+            return run()
+        
+        future = self._submit_stage(stage, run) if deadline > time.time() else None
+        return self._await_stage(stage, deadline, fallbacks, future, fallback)
+    
+    def _submit_stage(self, stage, run):
+        # None when too many abandoned runs of this stage still hold its threads
+        if self.abandoned[stage] >= self.max_abandoned:
+            return None
+        return self.stage_executors[stage].submit(run)
+    
+    def _await_stage(self, stage, deadline, fallbacks, future, fallback):
+        # future is None when the stage was never started: the deadline had
+        # passed or its pool is tied up by abandoned runs
+        if future is not None:
+            try:
+                return future.result(timeout=None if deadline is None else max(deadline - time.time(), 0))
+            except FutureTimeoutError:
+                if not future.cancel():
+                    # Already running: it keeps its thread, but nobody waits for it
+                    self._abandon(stage, future)
+        fallbacks.append(stage)
+        return fallback()
+    
+    def _abandon(self, stage, future):
+        with self.abandoned_lock:
+            self.abandoned[stage] += 1
+        
+        def finished(_):
+            with self.abandoned_lock:
+                self.abandoned[stage] -= 1
+        future.add_done_callback(finished)
+    
+    def _process_query(self, query, timings, deadline=None, fallbacks=None):
+        if self.parallel:
+            return self._process_query_parallel(query, timings, deadline, fallbacks)
+        
+        start = time.perf_counter()
+        cached, lookup = self._lookup_cache(query)
+        if self.cache:
+            timings["cache"] = time.perf_counter() - start
+        if cached is not None:
+            return cached
+        
+        start = time.perf_counter()
+        category, classifier_tier = self._run_stage(
+            "classify", deadline, fallbacks,
+            lambda: self.classifier.classify_with_tier(query),
+            lambda: (self.classifier.fallback_category(query), "fallback")
+        )
+        timings["classify"] = time.perf_counter() - start
+        return self._finish_query(query, category, classifier_tier, lookup, None, timings, deadline, fallbacks)
+    
+    def _process_query_parallel(self, query, timings, deadline=None, fallbacks=None):
+        # "classify" and "retrieve" overlap here. "cache" covers the exact
+        # lookup only; the semantic lookup is part of "retrieve".
+        start = time.perf_counter()
+        cached, lookup = self._lookup_cache(query, exact_only=True)
+        if self.cache:
+            timings["cache"] = time.perf_counter() - start
+        if cached is not None:
+            return cached
+        
+        classify_start = time.perf_counter()
+        classification = self._start_classification(query, deadline)
+        
+        # Past the deadline, generation does without the precomputed matches
+        start = time.perf_counter()
+        cached, lookup["embedding"], retrieval = self._run_stage(
+            "retrieve", deadline, fallbacks,
+            lambda: self._lookup_and_retrieve(query, lookup),
+            lambda: (None, None, None)
+        )
+        timings["retrieve"] = time.perf_counter() - start
+        if cached is not None:
+            # Wasted if it already started, but a semantic hit is rare enough not to wait for first
+            if classification is not None:
+                classification.cancel()
+            return cached
+        
+        (category, classifier_tier), timings["classify"] = self._await_stage(
+            "classify", deadline, fallbacks, classification,
+            lambda: ((self.classifier.fallback_category(query), "fallback"), time.perf_counter() - classify_start)
+        )
+        return self._finish_query(query, category, classifier_tier, lookup, retrieval, timings, deadline, fallbacks)
+    
+    def _finish_query(self, query, category, classifier_tier, lookup, retrieval, timings, deadline, fallbacks):
+        start = time.perf_counter()
+        draft_response = self._run_stage(
+            "generate", deadline, fallbacks,
+            lambda: self.response_agent.generate_response(query, category, query_embedding=lookup["embedding"],
+                                                          retrieval=retrieval),
+            lambda: self.response_agent.fallback_response(query, category, query_embedding=lookup["embedding"],
+                                                          retrieval=retrieval)
+        )
+        timings["generate"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        final_response = self._run_stage(
+            "review", deadline, fallbacks,
+            lambda: self._review(query, category, draft_response),
+            lambda: draft_response
+        )
+        timings["review"] = time.perf_counter() - start
+        
+        result = {
+            "category": category,
+            "response": final_response,
+            "classifier_tier": classifier_tier
+        }
+        if fallbacks:
+            # Degraded answers are not cached
+            return dict(result, cache="miss") if self.cache else result
+        return self._store_result(result, lookup)
     
-    def process_query(self, query):
-        print("Classifying query...")
-        category = self.classifier.classify_query(query)
-        print(f"Category: {category}")
+    def stream_query(self, query, deadline=None):
+        # Yields (event, data) pairs: the category first, then draft tokens,
+        # then reviewed tokens, and finally the complete result. Past the
+        # deadline, classification falls back to the keyword guess, drafting
+        # stops in favour of the retrieval answer and review is cut short; each
+        # is reported with a "fallback" event.
+        fallbacks = []
+        cached, lookup = self._lookup_cache(query, exact_only=self.parallel)
+        retrieval = None
+        if cached is None and self.parallel:
+            classification = self._start_classification(query, deadline)
+            cached, lookup["embedding"], retrieval = self._run_stage(
+                "retrieve", deadline, fallbacks,
+                lambda: self._lookup_and_retrieve(query, lookup),
+                lambda: (None, None, None)
+            )
+            if cached is not None and classification is not None:
+                classification.cancel()
+        if cached is not None:
+            yield "category", {"category": cached["category"], "classifier_tier": cached["classifier_tier"]}
+            yield "final", cached["response"]
+            yield "done", cached
+            return
         
-        print("Drafting response...")
-        draft_response = self.response_agent.generate_response(query, category)
-        print(f"Draft response: {draft_response}")
+        classify_fallback = lambda: (self.classifier.fallback_category(query), "fallback")
+        if self.parallel:
+            (category, classifier_tier), _ = self._await_stage("classify", deadline, fallbacks, classification,
+                                                               lambda: (classify_fallback(), 0.0))
+        else:
+            category, classifier_tier = self._run_stage(
+                "classify", deadline, fallbacks,
+                lambda: self.classifier.classify_with_tier(query),
+                classify_fallback
+            )
+        for stage in fallbacks:
+            yield "fallback", {"stage": stage}
+        yield "category", {"category": category, "classifier_tier": classifier_tier}
+        
+        draft_parts = []
+        # Token streams end early at the deadline; closing them stops their generation
+        with contextlib.closing(self.response_agent.stream_response(
+                query, category, query_embedding=lookup["embedding"], retrieval=retrieval, deadline=deadline)) as tokens:
+            for token in tokens:
+                if deadline is not None and time.time() > deadline:
+                    break
+                draft_parts.append(token)
+                yield "draft", token
+        if deadline is not None and time.time() > deadline:
+            fallbacks.append("generate")
+            draft_parts = [self.response_agent.fallback_response(query, category, query_embedding=lookup["embedding"],
+                                                                 retrieval=retrieval)]
+            yield "fallback", {"stage": "generate"}
+            yield "draft", draft_parts[0]
         
-        print("Reviewing response...")
-        final_response = self.review_agent.review_response(query, category, draft_response)
-        print(f"Final response: {final_response}")
+        draft_response = "".join(draft_parts)
+        final_parts = []
+        if deadline is not None and time.time() > deadline:
+            fallbacks.append("review")
+            final_parts.append(draft_response)
+            yield "fallback", {"stage": "review"}
+            yield "final", draft_response
+        elif self.response_agent.is_knowledge_base_answer(draft_response):
+            final_parts.append(self._run_stage(
+                "review", deadline, fallbacks,
+                lambda: self._review(query, category, draft_response),
+                lambda: draft_response
+            ))
+            if "review" in fallbacks:
+                yield "fallback", {"stage": "review"}
+            yield "final", final_parts[0]
+        else:
+            with contextlib.closing(self.review_agent.stream_review(query, category, draft_response,
+                                                                    deadline=deadline)) as tokens:
+                for token in tokens:
+                    if deadline is not None and time.time() > deadline:
+                        break
+                    final_parts.append(token)
+                    yield "final", token
+            if deadline is not None and time.time() > deadline:
+                # The result carries the unreviewed draft in place of the partial review
+                fallbacks.append("review")
+                final_parts = [draft_response]
+                yield "fallback", {"stage": "review"}
         
-        return {
+        result = {
             "category": category,
-            "response": final_response
+            "response": "".join(final_parts),
+            "classifier_tier": classifier_tier
         }
+        if fallbacks:
+            yield "done", dict(result, fallbacks=fallbacks)
+        else:
+            yield "done", self._store_result(result, lookup)
+    
+    def process_batch(self, queries, with_timings=False):
+        # Run each stage over the whole list so the agents can batch their model calls
+        queries = list(queries)
+        if not queries:
+            return []
+        timings = {}
+        results = self._process_batch(queries, timings)
+        if with_timings:
+            # Each result reports its share of the batch's stage times
+            amortized = {stage: seconds / len(queries) for stage, seconds in timings.items()}
+            for result in results:
+                result["timings"] = dict(amortized)
+        return results
+    
+    def _process_batch(self, queries, timings):
+        results = [None] * len(queries)
+        cache_keys = [None] * len(queries)
+        if self.cache:
+            start = time.perf_counter()
+            version = self.response_agent.knowledge_base_version
+            self.cache.sync_version(version)
+            for i, query in enumerate(queries):
+                cache_keys[i] = normalize_query(query)
+                cached = self.cache.get_exact(cache_keys[i])
+                if cached is not None:
+                    results[i] = dict(cached, cache="exact")
+                else:
+                    self.cache.record_miss()
+            timings["cache"] = time.perf_counter() - start
+        
+        # Only the queries that missed the cache go through the agents
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        pending_queries = [queries[i] for i in pending]
+        
+        start = time.perf_counter()
+        classified = self.classifier.classify_batch_with_tier(pending_queries)
+        categories = [category for category, _ in classified]
+        timings["classify"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        draft_responses = self.response_agent.generate_batch(pending_queries, categories)
+        timings["generate"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        final_responses = self._review_batch(pending_queries, categories, draft_responses)
+        timings["review"] = time.perf_counter() - start
+        
+        for i, (category, classifier_tier), final_response in zip(pending, classified, final_responses):
+            result = {"category": category, "response": final_response, "classifier_tier": classifier_tier}
+            if self.cache:
+                self.cache.put(cache_keys[i], None, result, version)
+                result = dict(result, cache="miss")
+            results[i] = result
+        return results
+
+    def _review(self, query, category, draft_response):
+        # Verbatim knowledge base answers are reviewed once per category, with
+        # a review that doesn't read the query, and reused for every query they
+        # answer; only free-form drafts go through the review agent every time
+        if self.response_agent.is_knowledge_base_answer(draft_response):
+            return self.review_memo.get_or_review(
+                draft_response,
+                lambda: self.review_agent.review_answer(category, draft_response),
+                (category,)
+            )
+        return self.review_agent.review_response(query, category, draft_response)
+    
+    def _review_batch(self, queries, categories, draft_responses):
+        final_responses = [None] * len(queries)
+        free_form = []
+        for i, draft_response in enumerate(draft_responses):
+            if self.response_agent.is_knowledge_base_answer(draft_response):
+                final_responses[i] = self._review(queries[i], categories[i], draft_response)
+            else:
+                free_form.append(i)
+        
+        if free_form:
+            reviewed = self.review_agent.review_batch(
+                [queries[i] for i in free_form],
+                [categories[i] for i in free_form],
+                [draft_responses[i] for i in free_form]
+            )
+            for i, final_response in zip(free_form, reviewed):
+                final_responses[i] = final_response
+        return final_responses
+    
+    def warm_up(self):
+        # Runs every stage directly, bypassing the response cache. Both the
+        # sequential path and the parallel one, which retrieves first and
+        # drafts from the matches, are exercised.
+        for query in WARM_UP_QUERIES:
+            category, _ = self.classifier.classify_with_tier(query)
+            draft_response = self.response_agent.generate_response(query, category)
+            retrieval = self.response_agent.retrieve(query)
+            self.response_agent.generate_response(query, category, retrieval=retrieval)
+            self.review_agent.review_response(query, category, draft_response)
+        categories = self.classifier.classify_batch(WARM_UP_QUERIES)
+        self.response_agent.generate_batch(WARM_UP_QUERIES, categories)
+    
+    def reload_knowledge_base(self):
+        # Picks up FAQ edits without a restart. Cached answers are dropped as
+        # soon as the new knowledge base is in place; memoized reviews are keyed
+        # by answer text, so edited answers get reviewed afresh.
+        stats = self.response_agent.reload_knowledge_base()
+        if self.cache:
+            self.cache.sync_version(self.response_agent.knowledge_base_version)
+        logging.getLogger(__name__).info("Knowledge base reload: %s", stats)
+        return stats
+    
+    def watch_knowledge_base(self, interval):
+        # Reloads whenever the FAQ file's modification time or size changes
+        def file_state():
+            try:
+                stat = os.stat(self.response_agent.faq_path)
+                return stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+        
+        def watch(last_seen):
+            while True:
+                time.sleep(interval)
+                seen = file_state()
+                if seen is not None and seen != last_seen:
+                    try:
+                        self.reload_knowledge_base()
+                    except Exception as e:
+                        # e.g. a half-written file; the next write triggers another attempt
+                        print(f"Error reloading knowledge base: {e}")
+                    last_seen = seen
+        
+        # Taken now, so edits made before the first poll are not missed
+        threading.Thread(target=watch, args=(file_state(),), name="knowledge-base-watcher", daemon=True).start()
+    
+    def cache_stats(self):
+        stats = self.cache.stats() if self.cache else {}
+        stats["review_memo"] = self.review_memo.stats()
+        return stats
 
 # For testing
 if __name__ == "__main__":
@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Word swaps used to paraphrase FAQ questions the way customers actually ask them
+SYNONYMS = {
+    "update": ["change", "edit", "modify"],
+    "reset": ["recover", "change"],
+    "password": ["passcode", "login password"],
+    "charged": ["billed"],
+    "receipt": ["invoice"],
+    "crashing": ["closing", "freezing"],
+    "enable": ["turn on", "set up"],
+    "contact": ["reach", "talk to"],
+    "find": ["get", "see"],
+    "business hours": ["opening hours", "hours"],
+}
+PREFIXES = ["", "", "Hi, ", "Hello! ", "Quick question: ", "Hey there, ", "Please help: "]
+SUFFIXES = ["", "", " Thanks!", " Thank you.", " Any ideas?", " ASAP please"]
+
+# Higher is better for these metrics; everything else is a cost
+HIGHER_IS_BETTER = {"qps", "calls_per_second", "success_rate"}
+
+
+def paraphrase_corpus(faq_path, size, seed=0):
+    # Synthetic customer queries: FAQ questions with swapped words, greetings,
+    # sign-offs and varied case and punctuation
+    with open(faq_path) as f:
+        questions = [qa['question'] for qa_pairs in json.load(f).values() for qa in qa_pairs]
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        text = rng.choice(questions)
+        for word, replacements in SYNONYMS.items():
+            if word in text.lower() and rng.random() < 0.5:
+                text = re.sub(re.escape(word), rng.choice(replacements), text, flags=re.IGNORECASE)
+        if rng.random() < 0.3:
+            text = text.lower()
+        if rng.random() < 0.3:
+            text = text.rstrip("?")
+        corpus.append(rng.choice(PREFIXES) + text + rng.choice(SUFFIXES))
+    return corpus
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def rss_bytes(pid=None):
+    # Current resident set size from /proc, or None where that isn't available
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def time_calls(function, inputs, warm_up=10):
+    for item in inputs[:warm_up]:
+        function(item)
+    seconds = []
+    start = time.perf_counter()
+    for item in inputs:
+        call_start = time.perf_counter()
+        function(item)
+        seconds.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    summary = latency_summary(seconds)
+    summary["calls_per_second"] = len(inputs) / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+def run_micro(corpus):
+    # Each agent on its own, on the same queries. Calls are sequential, so
+    # waiting for a micro-batch to fill would only add its window to every call.
+    os.environ.setdefault("EMBED_BATCH_WINDOW_MS", "0")
+    from simple_agents import SimpleClassifierAgent, SimpleResponseAgent, SimpleReviewAgent
+    classifier = SimpleClassifierAgent()
+    response_agent = SimpleResponseAgent()
+    review_agent = SimpleReviewAgent()
+
+    categories = [classifier.classify_query(query) for query in corpus]
+    drafts = [response_agent.generate_response(query, category) for query, category in zip(corpus, categories)]
+    cases = list(zip(corpus, categories, drafts))
+    return {
+        "classify_query": time_calls(classifier.classify_query, corpus),
+        "generate_response": time_calls(lambda case: response_agent.generate_response(case[0], case[1]), cases),
+        "review_response": time_calls(lambda case: review_agent.review_response(*case), cases),
+        "rss_bytes": rss_bytes(),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_api(port, timeout=300, response_cache=False):
+    # Starts the API in a child process and waits until it reports ready. The
+    # response cache is off unless asked for: the corpus repeats queries, so
+    # with it on most requests would only measure a dictionary lookup.
+    import requests
+    env = dict(os.environ)
+    if not response_cache:
+        env["RESPONSE_CACHE"] = "0"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited with code {server.returncode}")
+        try:
+            if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                return server, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("API did not become ready in time")
+
+
+def run_load(url, corpus, requests_total, concurrency, rate=None, seed=0, server_pid=None):
+    # Closed loop by default: `concurrency` clients each send their next query
+    # as soon as the last one returns. With a rate, queries arrive as a
+    # Poisson process whatever the response times, and latency is measured
+    # from the scheduled arrival so time spent waiting for a client counts too.
+    import requests
+    local = threading.local()
+    rng = random.Random(seed)
+    queries = [corpus[rng.randrange(len(corpus))] for _ in range(requests_total)]
+    latencies = []
+    statuses = {}
+    # Cache outcome reported by each answer: "exact", "semantic", "miss" or "off"
+    cache_results = {}
+    lock = threading.Lock()
+
+    def send(query, scheduled):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        cache = None
+        try:
+            response = session.post(f"{url}/support/query", json={"query": query}, timeout=60)
+            status = response.status_code
+            if status == 200:
+                cache = response.json().get("cache", "off")
+        except (requests.RequestException, ValueError):
+            status = "error"
+        finished = time.perf_counter()
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(finished - scheduled)
+                cache_results[cache] = cache_results.get(cache, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if rate:
+            scheduled = start
+            for query in queries:
+                scheduled += rng.expovariate(rate)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, query, scheduled)
+        else:
+            def client(offset):
+                for query in queries[offset::concurrency]:
+                    send(query, time.perf_counter())
+            for offset in range(concurrency):
+                executor.submit(client, offset)
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(latencies)
+    summary.update({
+        "qps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "success_rate": len(latencies) / requests_total if requests_total else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        # Share of answered queries served from the response cache rather than the pipeline
+        "cache_hit_ratio": (cache_results.get("exact", 0) + cache_results.get("semantic", 0)) / len(latencies)
+                           if latencies else 0.0,
+        "cache": dict(sorted(cache_results.items())),
+        "concurrency": concurrency,
+        "rate": rate,
+    })
+    if server_pid:
+        summary["rss_bytes"] = rss_bytes(server_pid)
+    return summary
+
+
+def flatten(report, prefix=""):
+    # {"load": {"p95_ms": 3}} -> {"load.p95_ms": 3}, numbers only
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(report, baseline, tolerance):
+    # Returns a line per metric that is worse than the baseline by more than the tolerance
+    regressions = []
+    current = flatten(report)
+    for name, expected in flatten(baseline).items():
+        metric = name.rsplit(".", 1)[-1]
+        if name not in current:
+            continue
+        actual = current[name]
+        if metric in HIGHER_IS_BETTER:
+            worse = actual < expected * (1 - tolerance)
+        elif metric.endswith("_ms") or metric == "rss_bytes":
+            worse = actual > expected * (1 + tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append(f"{name}: {actual:.4g} vs baseline {expected:.4g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the support pipeline and check for regressions")
+    parser.add_argument("mode", choices=["micro", "load", "all"], help="what to run")
+    parser.add_argument("--faq", default="knowledge_base/faq.json", help="FAQ the query corpus is derived from")
+    parser.add_argument("--corpus-size", type=int, default=500, help="Paraphrased queries to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="API to load (default: start one on a free port)")
+    parser.add_argument("--server-pid", type=int, default=None, help="Process whose RSS to report when --url is given")
+    parser.add_argument("--requests", type=int, default=1000, help="Queries sent by the load test")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--rate", type=float, default=None, help="Arrival rate in queries/s (default: closed loop)")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Keep the response cache on in the API started for the load test")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Fail if the report regresses against this JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    corpus = paraphrase_corpus(args.faq, args.corpus_size, args.seed)
+    report = {}
+    if args.mode in ("micro", "all"):
+        report["micro"] = run_micro(corpus)
+    if args.mode in ("load", "all"):
+        server = None
+        url, server_pid = args.url, args.server_pid
+        if url is None:
+            server, url = spawn_api(free_port(), response_cache=args.response_cache)
+            server_pid = server.pid
+        try:
+            report["load"] = run_load(url, corpus, args.requests, args.concurrency, args.rate, args.seed, server_pid)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from worker_pool import init_worker_system, call_worker_system
+
+
+def read_tickets(path):
+    # Yield one ticket dict at a time so the input is never fully in memory
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"offset": 0, "output_bytes": 0}
+
+
+def write_checkpoint(checkpoint_path, offset, output_bytes):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"offset": offset, "output_bytes": output_bytes}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def resume_output(output_path, checkpoint_path):
+    # Returns (tickets already done, mode to open the output with). Anything
+    # written after the last checkpoint is dropped so no result is duplicated.
+    checkpoint = read_checkpoint(checkpoint_path)
+    if not os.path.exists(output_path):
+        return checkpoint["offset"], 'wb'
+    with open(output_path, 'r+b') as f:
+        f.truncate(checkpoint["output_bytes"])
+    return checkpoint["offset"], 'ab'
+
+
+def process_file(input_path, output_path, checkpoint_path=None, resume=False, start_offset=0,
+                 workers=None, chunk_size=64, query_field="query", use_simple=True):
+    workers = workers or os.cpu_count() or 1
+    checkpoint_path = checkpoint_path or output_path + '.checkpoint'
+
+    mode = 'wb'
+    if resume:
+        start_offset, mode = resume_output(output_path, checkpoint_path)
+
+    tickets = islice(read_tickets(input_path), start_offset, None)
+    offset = start_offset
+    # Cap the chunks in flight so memory stays bounded however large the input is
+    max_in_flight = workers * 2
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker_system,
+        initargs=(use_simple,)
+    ) as executor, open(output_path, mode) as out:
+        in_flight = deque()
+
+        def write_next():
+            nonlocal offset
+            chunk, future = in_flight.popleft()
+            for ticket, result in zip(chunk, future.result()):
+                record = dict(ticket)
+                record.update(result)
+                out.write((json.dumps(record) + '\n').encode('utf-8'))
+            out.flush()
+            offset += len(chunk)
+            write_checkpoint(checkpoint_path, offset, out.tell())
+            print(f"Processed {offset} tickets")
+
+        for chunk in chunked(tickets, chunk_size):
+            queries = [str(ticket.get(query_field) or "") for ticket in chunk]
+            in_flight.append((chunk, executor.submit(call_worker_system, "process_batch", queries)))
+            if len(in_flight) >= max_in_flight:
+                write_next()
+
+        while in_flight:
+            write_next()
+
+    return offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a JSONL or CSV file of support tickets in bulk")
+    parser.add_argument("input", help="JSONL or CSV file of tickets")
+    parser.add_argument("output", help="JSONL file to write results to")
+    parser.add_argument("--query-field", default="query", help="Ticket field holding the customer query")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Tickets sent to a worker at a time")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    parser.add_argument("--start-offset", type=int, default=0, help="Skip this many tickets before processing")
+    parser.add_argument("--hf", action="store_true", help="Use the Hugging Face agents instead of the simple ones")
+    args = parser.parse_args()
+
+    total = process_file(
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        start_offset=args.start_offset,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        query_field=args.query_field,
+        use_simple=not args.hf
+    )
+    print(f"Done: {total} tickets written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
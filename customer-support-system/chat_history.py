@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import deque
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    created REAL NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (session_id, position)
+)
+"""
+
+# Seconds between sweeps for expired conversations, per database file
+PRUNE_INTERVAL = 60
+_last_pruned = {}
+
+
+class ChatHistory:
+    # One conversation. The newest messages stay in memory, capped by count
+    # and age; older ones are moved to a SQLite file and read back a page at
+    # a time when asked for. Positions count from the first message ever
+    # sent, wherever it is kept.
+    def __init__(self, session_id=None, path=None, max_messages=None, max_age=None, retention=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.path = path or os.getenv("CHAT_HISTORY_PATH", "chat_history.sqlite3")
+        self.max_messages = max_messages or int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "50"))
+        self.max_age = max_age or float(os.getenv("CHAT_HISTORY_MAX_AGE", "3600"))
+        # Conversations with nothing newer on disk than this are deleted
+        self.retention = retention or float(os.getenv("CHAT_HISTORY_RETENTION", str(7 * 24 * 3600)))
+        # (created, message) pairs, oldest first
+        self.recent = deque()
+        self.archived = 0
+
+    def __len__(self):
+        return self.archived + len(self.recent)
+
+    def connect(self):
+        # A connection per call, since Streamlit reruns a session on different threads
+        connection = sqlite3.connect(self.path)
+        connection.execute(SCHEMA)
+        self.prune(connection)
+        return connection
+
+    def prune(self, connection):
+        # Sessions end without telling us, so whole conversations are dropped
+        # once their newest stored message passes the retention age
+        now = time.time()
+        if now - _last_pruned.get(self.path, 0) < PRUNE_INTERVAL:
+            return
+        _last_pruned[self.path] = now
+        with connection:
+            connection.execute(
+                "DELETE FROM messages WHERE session_id IN "
+                "(SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created) < ?)",
+                (now - self.retention,)
+            )
+
+    def append(self, message):
+        self.recent.append((time.time(), dict(message)))
+        self.spill()
+
+    def spill(self):
+        # Moves messages past the size or age cap to disk in one transaction
+        cutoff = time.time() - self.max_age
+        rows = []
+        while self.recent and (len(self.recent) > self.max_messages or self.recent[0][0] < cutoff):
+            created, message = self.recent.popleft()
+            rows.append((self.session_id, self.archived + len(rows), created, json.dumps(message)))
+        if not rows:
+            return
+        with self.connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows)
+        connection.close()
+        self.archived += len(rows)
+
+    def messages(self, start=0, end=None):
+        # Messages start..end-1, in order, from disk and memory as needed
+        end = len(self) if end is None else min(end, len(self))
+        start = max(start, 0)
+        if start >= end:
+            return []
+        messages = []
+        if start < self.archived:
+            connection = self.connect()
+            try:
+                rows = connection.execute(
+                    "SELECT message FROM messages WHERE session_id = ? AND position >= ? AND position < ? "
+                    "ORDER BY position",
+                    (self.session_id, start, min(end, self.archived))
+                ).fetchall()
+            finally:
+                connection.close()
+            messages.extend(json.loads(row[0]) for row in rows)
+        first_recent = max(start - self.archived, 0)
+        for i in range(first_recent, end - self.archived):
+            messages.append(self.recent[i][1])
+        return messages
+
+    def tail(self, count):
+        return self.messages(len(self) - count)
+
+    def page_count(self, window):
+        # Pages of up to window messages before the last window messages
+        earlier = len(self) - window
+        return max((earlier + window - 1) // window, 0)
+
+    def page(self, page, window):
+        # Page 1 is the oldest. Pages are counted back from the live window,
+        # so only the oldest page can be short.
+        end = len(self) - window - (self.page_count(window) - page) * window
+        return self.messages(max(end - window, 0), end)
+
+    def clear(self):
+        if self.archived:
+            with self.connect() as connection:
+                connection.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+            connection.close()
+        self.recent.clear()
+        self.archived = 0
+
+
+def render_history(st, history, window, render_message):
+    # Draws the last window messages of a conversation in a Streamlit app.
+    # Earlier messages are read back and drawn a page at a time, only when
+    # asked for. st is the streamlit module, so this module doesn't import it.
+    earlier = len(history) - window
+    if earlier > 0 and st.toggle(f"Show earlier messages ({earlier})"):
+        pages = history.page_count(window)
+        page = st.number_input("Page", min_value=1, max_value=pages, value=pages)
+        for message in history.page(page, window):
+            render_message(message)
+        st.divider()
+
+    # Display the most recent messages on app rerun
+    for message in history.tail(window):
+        render_message(message)
@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+
+# Rows scored per step when a quantized matrix is multiplied, so only a block
+# of the matrix is ever widened to float32 at a time
+SCORE_BLOCK_ROWS = 8192
+
+
+def answer_key(text):
+    # Stable 64-bit key; equal keys are confirmed against the stored text
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class FAQRecord:
+    # Lightweight view of one entry. Texts are decoded from the store on
+    # access, and records also support qa['question'] style lookups.
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def question(self):
+        return self.store.text(2 * self.row)
+
+    @property
+    def answer(self):
+        return self.store.text(2 * self.row + 1)
+
+    @property
+    def category(self):
+        return self.store.categories[self.store.category_ids[self.row]]
+
+    def __getitem__(self, field):
+        if field not in ("question", "answer", "category"):
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        return isinstance(other, FAQRecord) and other.store is self.store and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    def __repr__(self):
+        return f"FAQRecord(category={self.category!r}, question={self.question!r})"
+
+
+class FAQStore:
+    # All questions and answers in one UTF-8 buffer with an offset array, in
+    # place of a dict and two str objects per entry. Entry i's question is
+    # text 2i and its answer text 2i+1; rows are grouped by category.
+    def __init__(self, data, text_offsets, categories, category_ids):
+        self.data = data
+        self.text_offsets = text_offsets
+        self.categories = categories
+        self.category_ids = category_ids
+        answer_keys = np.array([answer_key(self.text(2 * row + 1)) for row in range(len(self))], dtype=np.uint64)
+        self.answer_order = np.argsort(answer_keys, kind="stable").astype(np.int32)
+        self.answer_keys = answer_keys[self.answer_order]
+
+    @classmethod
+    def from_faqs(cls, faqs):
+        texts = bytearray()
+        offsets = [0]
+        categories = list(faqs)
+        category_ids = []
+        for category_id, qa_pairs in enumerate(faqs.values()):
+            for qa in qa_pairs:
+                for text in (qa['question'], qa['answer']):
+                    texts += text.encode('utf-8')
+                    offsets.append(len(texts))
+                category_ids.append(category_id)
+        id_type = np.uint8 if len(categories) <= 256 else np.uint16
+        return cls(bytes(texts), np.array(offsets, dtype=np.int64), categories, np.array(category_ids, dtype=id_type))
+
+    def __len__(self):
+        return len(self.category_ids)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return FAQRecord(self, row)
+
+    def __iter__(self):
+        return (FAQRecord(self, row) for row in range(len(self)))
+
+    def text(self, i):
+        return self.data[self.text_offsets[i]:self.text_offsets[i + 1]].decode('utf-8')
+
+    def has_answer(self, text):
+        key = np.uint64(answer_key(text))
+        position = int(np.searchsorted(self.answer_keys, key))
+        while position < len(self.answer_keys) and self.answer_keys[position] == key:
+            if self.text(2 * int(self.answer_order[position]) + 1) == text:
+                return True
+            position += 1
+        return False
+
+    def to_faqs(self):
+        # The original {category: [{"question", "answer"}, ...]} layout, built on demand
+        faqs = {category: [] for category in self.categories}
+        for record in self:
+            faqs[record.category].append({"question": record.question, "answer": record.answer})
+        return faqs
+
+    @property
+    def nbytes(self):
+        arrays = (self.text_offsets, self.category_ids, self.answer_order, self.answer_keys)
+        return len(self.data) + sum(array.nbytes for array in arrays)
+
+
+class QuantizedMatrix:
+    # Read-only embedding matrix stored as float16, or as int8 with one scale
+    # per row (row = scale * int8 values). Inner products are taken block by
+    # block on the compact data, so no float32 copy of the matrix is made.
+    def __init__(self, data, scales=None):
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, matrix, dtype):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype == "float16":
+            return cls(matrix.astype(np.float16))
+        if dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales[scales == 0] = 1.0
+            data = np.round(matrix / scales[:, None]).astype(np.int8)
+            return cls(data, scales.astype(np.float32))
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+
+    @property
+    def dtype(self):
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, rows):
+        # Slices stay quantized views; any other index returns float32 rows
+        if isinstance(rows, slice):
+            return QuantizedMatrix(self.data[rows], None if self.scales is None else self.scales[rows])
+        return self.dequantize(rows)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.dequantize(row)
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.dequantize(slice(None))
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def dequantize(self, rows):
+        values = self.data[rows].astype(np.float32)
+        if self.scales is not None:
+            scales = self.scales[rows]
+            values *= scales[..., None] if np.ndim(scales) else scales
+        return values
+
+    def inner_products(self, query_vectors):
+        # (len(query_vectors), len(self)) similarities, like query_vectors @ matrix.T
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        scores = np.empty((len(query_vectors), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, len(self))
+            block = query_vectors @ self.data[start:end].T.astype(np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:end]
+            scores[:, start:end] = block
+        return scores
+
+
+def same_rows(a, b):
+    # True if both matrices hold the same rows in the same representation.
+    # Quantized matrices are compared on their stored values and scales, so
+    # neither is expanded to float32.
+    if a.shape != b.shape or isinstance(a, QuantizedMatrix) != isinstance(b, QuantizedMatrix):
+        return False
+    if not isinstance(a, QuantizedMatrix):
+        return np.array_equal(a, b)
+    if (a.scales is None) != (b.scales is None):
+        return False
+    return np.array_equal(a.data, b.data) and (a.scales is None or np.array_equal(a.scales, b.scales))
+
+
+def compact_matrix(matrix, dtype):
+    # float32 matrices are used as they are
+    if dtype == "float32":
+        return matrix
+    return QuantizedMatrix.quantize(matrix, dtype)
+
+
+def deep_sizeof(value, seen=None):
+    # Bytes held by a nest of dicts, lists and strings, counting shared objects once
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    return size
+
+
+def synthetic_faqs(faq_path, entries):
+    # Repeats the real FAQ with numbered variations up to the requested size
+    with open(faq_path) as f:
+        base = [(category, qa) for category, qa_pairs in json.load(f).items() for qa in qa_pairs]
+    faqs = {}
+    for i in range(entries):
+        category, qa = base[i % len(base)]
+        faqs.setdefault(category, []).append({
+            "question": f"{qa['question']} (variant {i})",
+            "answer": f"{qa['answer']} Reference {i}."
+        })
+    return faqs
+
+
+def memory_report(faq_path, entries, dim, queries=200, seed=0, index_kind="hnsw"):
+    # The search index is counted too: with faiss installed, an ANN index holds
+    # its own copy of the vectors, which can outweigh the matrix itself
+    from retrieval import VectorIndex
+    rng = np.random.default_rng(seed)
+    faqs = synthetic_faqs(faq_path, entries)
+    count = sum(len(qa_pairs) for qa_pairs in faqs.values())
+    matrix = rng.standard_normal((count, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Queries near known rows, so top-1 agreement measures quantization error rather than noise
+    targets = rng.integers(0, count, queries)
+    query_vectors = matrix[targets] + rng.standard_normal((queries, dim)).astype(np.float32) * 0.03
+    exact_top = np.argmax(query_vectors @ matrix.T, axis=1)
+
+    store = FAQStore.from_faqs(faqs)
+    text_before = deep_sizeof(faqs)
+    rows = []
+    for dtype in ("float32", "float16", "int8"):
+        compact = compact_matrix(matrix, dtype)
+        index = VectorIndex(compact, kind=index_kind)
+        _, top = index.search(query_vectors, 1)
+        row = {
+            "text_bytes": store.nbytes,
+            "embedding_bytes": compact.nbytes,
+            "index_bytes": index.nbytes,
+            "top1_agreement": float(np.mean(top[:, 0] == exact_top))
+        }
+        if dtype == "float32":
+            # The original layout differs from the compact one only in its text
+            rows.append(dict(row, layout="dicts + float32", text_bytes=text_before))
+        rows.append(dict(row, layout=f"store + {dtype}"))
+    for row in rows:
+        row["bytes_per_entry"] = round((row["text_bytes"] + row["embedding_bytes"] + row["index_bytes"]) / count, 1)
+    return {"entries": count, "dim": dim, "index": index_kind, "layouts": rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare memory per FAQ entry for the nested-dict and compact layouts.")
+    parser.add_argument("--faq", default="knowledge_base/faq.json")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384, help="embedding size (384 for all-MiniLM-L6-v2)")
+    parser.add_argument("--index", choices=["hnsw", "ivf", "exact"], default=os.getenv("RETRIEVAL_INDEX", "hnsw"),
+                        help="search index to build over each layout (default: RETRIEVAL_INDEX or hnsw)")
+    args = parser.parse_args(argv)
+
+    report = memory_report(args.faq, args.entries, args.dim, index_kind=args.index)
+    print(f"{report['entries']} entries, {report['dim']}-dimensional embeddings, {report['index']} index")
+    print(f"{'layout':<18} {'text':>12} {'embeddings':>12} {'index':>12} {'bytes/entry':>12} {'top-1 agree':>12}")
+    for row in report["layouts"]:
+        print(f"{row['layout']:<18} {row['text_bytes']:>12} {row['embedding_bytes']:>12} {row['index_bytes']:>12} "
+              f"{row['bytes_per_entry']:>12} {row['top1_agreement']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
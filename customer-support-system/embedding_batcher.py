@@ -0,0 +1,81 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class EmbeddingBatcher:
+    # Collects encode calls from concurrent requests and runs them through the
+    # model as one batch, handing each caller back its own rows
+    def __init__(self, encoder, window_ms=5, max_batch_size=32):
+        self.encoder = encoder
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def encode(self, texts):
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.window
+
+            # Take whatever is already queued. A request that arrived alone is
+            # encoded at once rather than waiting out the window; calls that
+            # arrive while it runs queue up and form the next batch.
+            while size < self.max_batch_size:
+                try:
+                    item = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            if len(batch) == 1:
+                self._encode_batch(batch)
+                continue
+
+            # Under concurrency, keep collecting until the window closes or the batch is full
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            embeddings = np.asarray(self.encoder.encode(texts))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for item_texts, future in batch:
+            end = start + len(item_texts)
+            future.set_result(embeddings[start:end])
+            start = end
+
+
+def batched_encoder(encoder):
+    # EMBED_BATCH_WINDOW_MS=0 turns batching off and calls the model directly
+    window_ms = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+    if window_ms <= 0:
+        return encoder
+    max_batch_size = int(os.getenv("EMBED_MAX_BATCH", "32"))
+    return EmbeddingBatcher(encoder, window_ms=window_ms, max_batch_size=max_batch_size)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from compact_store import FAQStore, QuantizedMatrix, compact_matrix
+from file_lock import file_lock, write_atomically
+from lexical_index import BM25Index
+from retrieval import retriever_from_env
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FAQSnapshot:
+    # Immutable view of the knowledge base: the FAQ entries in a compact store
+    # plus one normalized embedding matrix whose rows are grouped by category
+    def __init__(self, faqs, matrix, offsets, faq_hash, previous=None, save_prefix=None, lock_path=None):
+        self.store = FAQStore.from_faqs(faqs)
+        self.matrix = matrix
+        self.offsets = offsets
+        self.faq_hash = faq_hash
+        # Record views over the store, indexable like the original list of dicts
+        self.items = self.store
+        # Indexes of categories whose rows didn't change are carried over from the previous snapshot
+        self.retriever = retriever_from_env(matrix, offsets, self.items,
+                                            previous=previous.retriever if previous else None,
+                                            texts=(f"{qa.question} {qa.answer}" for qa in self.items),
+                                            save_prefix=save_prefix, version=faq_hash, lock_path=lock_path)
+        # Per-category BM25 indexes for lexical_match, built the first time a category needs one
+        self._lexical = {}
+        self._lexical_lock = threading.Lock()
+
+    def has_category(self, category):
+        start, end = self.offsets.get(category, (0, 0))
+        return end > start
+
+    def is_answer(self, text):
+        return self.store.has_answer(text)
+
+    def category_matrix(self, category):
+        start, end = self.offsets.get(category, (0, 0))
+        return self.matrix[start:end]
+
+    def best_match(self, query_embedding, category, query=None):
+        queries = None if query is None else [query]
+        return self.best_matches(query_embedding.reshape(1, -1), [category], queries)[0]
+
+    def lexical_match(self, query, category):
+        # Best entry of the category by keyword score, without embedding the
+        # query; (None, 0.0) when it shares no term with any entry
+        start, end = self.offsets.get(category, (0, 0))
+        if end <= start:
+            return None, 0.0
+        index = self._lexical.get(category)
+        if index is None:
+            with self._lexical_lock:
+                index = self._lexical.get(category)
+                if index is None:
+                    index = BM25Index()
+                    for row in range(start, end):
+                        qa = self.items[row]
+                        index.add(row, f"{qa.question} {qa.answer}")
+                    self._lexical[category] = index
+        hits = index.search(query, k=1)
+        if not hits:
+            return None, 0.0
+        row, score = hits[0]
+        return self.items[row], score
+
+    def best_matches(self, query_embeddings, categories, queries=None):
+        # Rows and queries are unit length, so inner product is cosine similarity.
+        # Only the query's own category is searched. With the query texts,
+        # lexical matches are fused into the ranking.
+        matches = []
+        for hits in self.retriever.search_batch(query_embeddings, categories, k=1, fallback=False,
+                                                query_texts=queries):
+            matches.append(hits[0] if hits else (None, 0.0))
+        return matches
+
+
+class FAQIndex:
+    def __init__(self, encoder, model_name, faq_path='knowledge_base/faq.json', dtype=None):
+        self.encoder = encoder
+        self.model_name = model_name
+        self.faq_path = faq_path
+        # Embeddings are kept as float32, float16, or int8 with a scale per row
+        self.dtype = dtype or os.getenv("EMBEDDING_DTYPE", "float32")
+        if self.dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {self.dtype}")
+        base_path = os.path.splitext(faq_path)[0]
+        self.matrix_path = base_path + '.index.npy'
+        self.scales_path = base_path + '.index.scales.npy'
+        self.meta_path = base_path + '.index.json'
+        # Serializes index writes across processes; readers hold it shared
+        self.lock_path = base_path + '.index.lock'
+        # Prefix of the saved vector index files, one per category and build options
+        self.index_prefix = base_path + '.index'
+        self.reload_lock = threading.Lock()
+        self.snapshot = self.load()
+
+    def encode_query(self, query):
+        return self.encode_queries([query])[0]
+
+    def encode_queries(self, queries):
+        return normalize_rows(self.encoder.encode(list(queries)))
+
+    def load(self):
+        with open(self.faq_path, 'rb') as f:
+            raw = f.read()
+        faqs = json.loads(raw)
+        faq_hash = hashlib.sha256(self.model_name.encode('utf-8') + b'\0' + raw).hexdigest()
+
+        with file_lock(self.lock_path, shared=True):
+            saved = self.load_saved(faq_hash)
+        if saved is None:
+            # Only one process builds; the others find its index once they get the lock
+            with file_lock(self.lock_path):
+                saved = self.load_saved(faq_hash)
+                if saved is None:
+                    matrix, offsets = self.build(faqs)
+                    saved = self.save_and_map(matrix, offsets, faq_hash)
+        return self.new_snapshot(faqs, *saved, faq_hash)
+
+    def new_snapshot(self, faqs, matrix, offsets, faq_hash, previous=None):
+        # Vector indexes are saved next to the matrix, under the same lock
+        return FAQSnapshot(faqs, matrix, offsets, faq_hash, previous=previous,
+                           save_prefix=self.index_prefix, lock_path=self.lock_path)
+
+    def load_saved(self, faq_hash):
+        # (matrix, offsets) from the saved index if it matches the FAQ file and
+        # is intact, otherwise None so the caller rebuilds it
+        meta = self._read_meta()
+        if not (meta and meta.get('faq_hash') == faq_hash and meta.get('dtype', 'float32') == self.dtype
+                and os.path.exists(self.matrix_path)):
+            return None
+        offsets = {category: tuple(span) for category, span in meta['offsets'].items()}
+        try:
+            matrix = self.load_matrix()
+        except (OSError, ValueError) as e:
+            print(f"Rebuilding unreadable FAQ index: {e}")
+            return None
+        rows = sum(end - start for start, end in offsets.values())
+        scales = getattr(matrix, 'scales', None)
+        if matrix.ndim != 2 or len(matrix) != rows or (scales is not None and len(scales) != rows):
+            print(f"Rebuilding FAQ index: {matrix.shape} does not fit {rows} entries")
+            return None
+        return matrix, offsets
+
+    def save_and_map(self, matrix, offsets, faq_hash):
+        # Call with the lock held. Serves from the file once saved, so every
+        # process on the host shares one copy of its pages.
+        matrix = compact_matrix(matrix, self.dtype)
+        if self.save(matrix, offsets, faq_hash):
+            matrix = self.load_matrix()
+        return matrix, offsets
+
+    def load_matrix(self):
+        data = np.load(self.matrix_path, mmap_mode='r')
+        if self.dtype == "float32":
+            return data
+        scales = np.load(self.scales_path, mmap_mode='r') if self.dtype == "int8" else None
+        return QuantizedMatrix(data, scales)
+
+    def reload(self):
+        # Re-reads the FAQ file and embeds only the questions the current
+        # snapshot doesn't already have. The new snapshot is built on the side
+        # and swapped in with one assignment, so queries in flight finish on
+        # the snapshot they started with.
+        with self.reload_lock:
+            previous = self.snapshot
+            with open(self.faq_path, 'rb') as f:
+                raw = f.read()
+            faqs = json.loads(raw)
+            faq_hash = hashlib.sha256(self.model_name.encode('utf-8') + b'\0' + raw).hexdigest()
+            if faq_hash == previous.faq_hash:
+                return {"reloaded": False, "version": faq_hash}
+
+            known = {qa['question']: row for qa, row in zip(previous.items, previous.matrix)}
+            questions = {qa['question'] for qa_pairs in faqs.values() for qa in qa_pairs}
+            matrix, offsets = self.build(faqs, known)
+            with file_lock(self.lock_path):
+                matrix, offsets = self.save_and_map(matrix, offsets, faq_hash)
+            self.snapshot = self.new_snapshot(faqs, matrix, offsets, faq_hash, previous=previous)
+            return {
+                "reloaded": True,
+                "version": faq_hash,
+                "entries": len(self.snapshot.items),
+                "embedded": len(questions - known.keys()),
+                "removed": len(known.keys() - questions)
+            }
+
+    def build(self, faqs, known=None):
+        # known maps question text to an existing embedding row that can be reused
+        questions = []
+        offsets = {}
+        for category, qa_pairs in faqs.items():
+            start = len(questions)
+            questions.extend(qa['question'] for qa in qa_pairs)
+            offsets[category] = (start, len(questions))
+
+        if not questions:
+            return np.zeros((0, 0), dtype=np.float32), offsets
+        rows = dict(known or {})
+        missing = [question for question in dict.fromkeys(questions) if question not in rows]
+        if missing:
+            rows.update(zip(missing, normalize_rows(self.encoder.encode(missing))))
+        return np.stack([rows[question] for question in questions]).astype(np.float32), offsets
+
+    def save(self, matrix, offsets, faq_hash):
+        try:
+            # Write the matrix before the metadata so a crash never leaves a
+            # hash pointing at a stale matrix
+            arrays = [(self.matrix_path, matrix)]
+            if isinstance(matrix, QuantizedMatrix):
+                arrays = [(self.matrix_path, matrix.data)]
+                if matrix.scales is not None:
+                    arrays.append((self.scales_path, matrix.scales))
+            for path, array in arrays:
+                write_atomically(path, lambda f: np.save(f, array))
+
+            meta = {
+                "faq_hash": faq_hash,
+                "model": self.model_name,
+                "dtype": self.dtype,
+                "offsets": {category: list(span) for category, span in offsets.items()}
+            }
+            write_atomically(self.meta_path, lambda f: json.dump(meta, f), binary=False)
+            return True
+        except OSError as e:
+            print(f"Error saving FAQ index: {e}")
+            return False
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
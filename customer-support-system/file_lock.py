@@ -0,0 +1,40 @@
+import contextlib
+import fcntl
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    # Advisory lock across processes, held for the duration of the block.
+    # Readers take it shared, writers exclusive. Where the lock file can't be
+    # created (a read-only directory) nobody can write either, so no lock is needed.
+    try:
+        f = open(path, "a")
+    except OSError:
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomically(path, write, binary=True):
+    # Calls write(file) on a uniquely named temp file next to path, then
+    # renames it into place, so readers see either the old or the new file
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        # mkstemp creates the file 0600; other users may read the index as before
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb" if binary else "w") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import os
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+import worker_pool
+
+# One process owns the models and serves every API worker over a Unix socket.
+# Each connection gets its own thread, so requests from different workers run
+# concurrently and their embedding calls are coalesced by the micro-batcher.
+#
+# Requests are (kind, method, args, kwargs) tuples where kind is "status",
+# "call" or "stream". Replies are ("ok", value), ("not_ready", None) or
+# ("error", message); a stream sends ("item", value) per item and then
+# ("end", None). Connections must authenticate with the server's key first.
+
+
+def prepare_socket_directory(address):
+    # The default socket lives in a per-user directory; refuse one that
+    # somebody else created or that others can enter
+    directory = os.path.dirname(address) or "."
+    if os.path.dirname(worker_pool.DEFAULT_INFERENCE_SOCKET) == directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        stat = os.lstat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise PermissionError(f"{directory} must be owned by this user with mode 0700")
+
+
+def write_authkey(address):
+    # A fresh key per start, readable only by this user
+    key = os.getenv("SUPPORT_INFERENCE_AUTHKEY")
+    if key:
+        return key.encode("utf-8")
+    key = os.urandom(32)
+    key_path = worker_pool.inference_key_path(address)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(key_path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, key_path)
+    return key
+
+
+class InferenceServer:
+    def __init__(self, address, use_simple=True):
+        self.address = address
+        self.use_simple = use_simple
+        self.ready = threading.Event()
+        self.load_error = None
+
+    def load(self):
+        try:
+            worker_pool.init_worker_system(self.use_simple, warm_up=True)
+            self.ready.set()
+        except Exception as e:
+            print(f"Error loading support system: {e}")
+            self.load_error = str(e)
+
+    def serve_forever(self):
+        prepare_socket_directory(self.address)
+        authkey = write_authkey(self.address)
+        # A socket left behind by a previous run would make bind() fail
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Created 0600, so only processes running as the same user can connect at all
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+        threading.Thread(target=self.load, name="support-loader", daemon=True).start()
+        print(f"Inference server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    print(f"Rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    kind, method, args, kwargs = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    self.respond(connection, kind, method, args, kwargs)
+                except (EOFError, OSError, BrokenPipeError):
+                    return
+
+    def respond(self, connection, kind, method, args, kwargs):
+        if kind == "status":
+            connection.send(("ok", {"ready": self.ready.is_set(), "error": self.load_error, "pid": os.getpid()}))
+            return
+        if not self.ready.is_set():
+            connection.send(("not_ready", None))
+            return
+
+        try:
+            if kind == "call":
+                connection.send(("ok", worker_pool.call_worker_system(method, *args, **kwargs)))
+            elif kind == "stream":
+                # A client that stops reading closes its connection; the failed
+                # send then closes the generator, which stops its generation
+                with contextlib.closing(getattr(worker_pool._worker_system, method)(*args, **kwargs)) as items:
+                    for item in items:
+                        connection.send(("item", item))
+                connection.send(("end", None))
+            else:
+                connection.send(("error", f"Unknown request kind: {kind}"))
+        except (EOFError, OSError):
+            raise
+        except Exception as e:
+            connection.send(("error", str(e)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the support pipeline to API workers over a Unix socket.")
+    parser.add_argument("--socket", default=os.getenv("SUPPORT_INFERENCE_SOCKET", worker_pool.DEFAULT_INFERENCE_SOCKET))
+    parser.add_argument("--full", action="store_true", help="load the Hugging Face agents instead of the simple ones")
+    args = parser.parse_args(argv)
+
+    use_simple = not args.full and os.getenv("SUPPORT_USE_SIMPLE", "1") != "0"
+    InferenceServer(args.socket, use_simple=use_simple).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over a table of labelled keywords. Keywords may be
+    # plain strings (weight 1) or (keyword, weight) pairs, and may span several words.
+    # word_boundary matches only whole words. word_start names labels whose
+    # keywords must start a word but may end inside one, so "hate" still
+    # matches "hateful" but not "whatever".
+    def __init__(self, keyword_table, word_boundary=False, word_start=()):
+        self.word_boundary = word_boundary
+        self.labels = list(keyword_table.keys())
+        word_start = set(word_start)
+        # Per keyword: (label, weight, length), and whether it must start a word
+        self.keyword_info = []
+        self.starts_word = []
+
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+        for label, keywords in keyword_table.items():
+            for keyword in keywords:
+                if isinstance(keyword, (tuple, list)):
+                    keyword, weight = keyword
+                else:
+                    weight = 1
+                keyword = keyword.lower()
+                if not keyword:
+                    continue
+                self._add(keyword, len(self.keyword_info))
+                self.keyword_info.append((label, weight, len(keyword)))
+                self.starts_word.append(label in word_start)
+
+        self._build_fail_links()
+
+    def _add(self, keyword, keyword_id):
+        state = 0
+        for char in keyword:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][char] = next_state
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(keyword_id)
+
+    def _build_fail_links(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(char, 0)
+                # A state also emits every keyword that ends at its fail state
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        # Yields (start, end, keyword_id) for every occurrence in a single scan.
+        # Callers pass text already lowercased when they need offsets into it.
+        transitions = self.transitions
+        fail = self.fail
+        outputs = self.outputs
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            for keyword_id in outputs[state]:
+                start = i + 1 - self.keyword_info[keyword_id][2]
+                if self.word_boundary and not self._on_boundary(text, start, i + 1):
+                    continue
+                if self.starts_word[keyword_id] and start > 0 and text[start - 1].isalnum():
+                    continue
+                yield start, i + 1, keyword_id
+
+    def _on_boundary(self, text, start, end):
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not before.isalnum() and not after.isalnum()
+
+    def score(self, text):
+        # Each keyword counts once, however often it occurs, like a substring check
+        scores = {label: 0 for label in self.labels}
+        seen = set()
+        for _, _, keyword_id in self.iter_matches(text.lower()):
+            if keyword_id in seen:
+                continue
+            seen.add(keyword_id)
+            label, weight, _ = self.keyword_info[keyword_id]
+            scores[label] += weight
+        return scores
@@ -0,0 +1,120 @@
+import math
+import re
+
+# Common words that carry no signal for matching support questions
+STOPWORDS = frozenset("""
+a about am an and any are as at be been but by can could did do does doing for from had has have how i if in
+into is it its me my no not of on or our please so than that the their them then there these they this to
+too was we were what when where which who why will with would you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text):
+    # Identifiers such as "ERR-1042" or "pro_plus" are kept whole and also
+    # split into their parts, so "err 1042" still matches
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        parts = re.split(r"[-_.]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    # Okapi BM25 over an inverted index. Documents can be added and removed
+    # one at a time; term statistics are read at query time, so nothing has
+    # to be rebuilt after an update.
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self.postings = {}
+        # doc_id -> (set of terms, document length)
+        self.documents = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def copy(self):
+        # Independent copy, so updates can be prepared without disturbing readers of this one
+        clone = BM25Index(self.k1, self.b)
+        clone.postings = {term: dict(docs) for term, docs in self.postings.items()}
+        clone.documents = dict(self.documents)
+        clone.total_length = self.total_length
+        return clone
+
+    def add(self, doc_id, text):
+        if doc_id in self.documents:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.documents[doc_id] = (frozenset(frequencies), len(tokens))
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id):
+        terms, length = self.documents.pop(doc_id)
+        for term in terms:
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+        self.total_length -= length
+
+    def document_frequency(self, term):
+        return len(self.postings.get(term, ()))
+
+    def scores(self, text):
+        # Returns {doc_id: score} for every document sharing a term with the text
+        count = len(self.documents)
+        if not count:
+            return {}
+        average_length = self.total_length / count
+        scores = {}
+        for term in set(tokenize(text)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                length = self.documents[doc_id][1]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, text, k=10, doc_filter=None):
+        # Top k (doc_id, score) pairs, best first, optionally limited to ids passing doc_filter
+        scores = self.scores(text)
+        if doc_filter is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_filter(doc_id)}
+        return sorted(scores.items(), key=lambda hit: hit[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    # Combines ranked lists of ids; only ranks matter, so the scores need not be comparable
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
+
+def weighted_fusion(dense_scores, lexical_scores, dense_weight=0.5):
+    # Mixes cosine similarities with BM25 scores scaled to [0, 1] by the best lexical hit
+    top_lexical = max(lexical_scores.values(), default=0.0)
+    fused = {}
+    for doc_id in dense_scores.keys() | lexical_scores.keys():
+        lexical = lexical_scores.get(doc_id, 0.0) / top_lexical if top_lexical > 0 else 0.0
+        fused[doc_id] = dense_weight * dense_scores.get(doc_id, 0.0) + (1 - dense_weight) * lexical
+    return fused
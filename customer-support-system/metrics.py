@@ -0,0 +1,146 @@
+import bisect
+import json
+import logging
+import random
+import threading
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    # Fixed buckets, so an observation is a bisect and two additions
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # Per label set: [bucket counts..., +Inf count], sum
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(self.labelnames + ("le",), labels + (str(bound),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                series_labels = format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{series_labels} {total}")
+                lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "support_stage_seconds", "Time spent in each pipeline stage", ("stage",)))
+BATCH_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "support_batch_stage_seconds", "Time spent in each pipeline stage for a whole batch", ("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "support_request_seconds", "End-to-end request latency including queueing", ("endpoint",)))
+QUERIES_TOTAL = REGISTRY.register(Counter(
+    "support_queries_total", "Queries answered, by category and classifier tier", ("category", "classifier_tier")))
+CACHE_TOTAL = REGISTRY.register(Counter(
+    "support_cache_total", "Response cache lookups, by result", ("result",)))
+FALLBACK_TOTAL = REGISTRY.register(Counter(
+    "support_fallback_total", "Stages replaced by their fallback after running out of latency budget", ("stage",)))
+REJECTED_TOTAL = REGISTRY.register(Counter(
+    "support_rejected_total", "Requests rejected because the worker pool was full", ("endpoint",)))
+
+
+def record_result(result):
+    # Results carry their own stage timings, so this works in the API process
+    # whether the pipeline ran in a thread or in a worker process
+    for stage, seconds in result.get("timings", {}).items():
+        STAGE_SECONDS.observe(seconds, stage)
+    if "category" in result:
+        QUERIES_TOTAL.inc(result["category"], result.get("classifier_tier", "unknown"))
+    if "cache" in result:
+        CACHE_TOTAL.inc(result["cache"])
+    for stage in result.get("fallbacks", []):
+        FALLBACK_TOTAL.inc(stage)
+
+
+def record_batch(results):
+    # Each batch result carries an equal share of the batch's stage times.
+    # The batch is observed once with their sum, so the per-query stage
+    # histograms aren't filled with identical averaged samples.
+    totals = {}
+    for result in results:
+        for stage, seconds in result.get("timings", {}).items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        record_result({key: value for key, value in result.items() if key != "timings"})
+    for stage, seconds in totals.items():
+        BATCH_STAGE_SECONDS.observe(seconds, stage)
+
+
+class SampledLogger:
+    # Logs one structured JSON line for roughly `rate` of the calls, so the
+    # hot path doesn't pay for formatting and I/O on every request
+    def __init__(self, logger, rate):
+        self.logger = logger
+        self.rate = rate
+
+    def info(self, event, **fields):
+        if self.rate <= 0 or (self.rate < 1 and random.random() >= self.rate):
+            return
+        if self.logger.isEnabledFor(logging.INFO):
+            fields["event"] = event
+            self.logger.info(json.dumps(fields, default=str))
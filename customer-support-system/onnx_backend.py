@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import numpy as np
+from file_lock import file_lock
+
+# Optimum model class per pipeline task
+ORT_MODEL_CLASSES = {
+    "feature-extraction": "ORTModelForFeatureExtraction",
+    "zero-shot-classification": "ORTModelForSequenceClassification",
+    "text-generation": "ORTModelForCausalLM",
+    "text2text-generation": "ORTModelForSeq2SeqLM",
+}
+
+
+def inference_backend():
+    # "torch" runs the models as full-precision PyTorch, "onnx" as int8 ONNX Runtime
+    backend = os.getenv("INFERENCE_BACKEND", "torch")
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return backend
+
+
+def onnx_cache_dir():
+    return os.getenv("ONNX_CACHE_DIR", "models/onnx")
+
+
+def quantization_config():
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    # Dynamic quantization needs no calibration data: weights are stored as
+    # int8 and activations are quantized per batch at run time
+    target = os.getenv("ONNX_QUANTIZATION")
+    if target is None:
+        target = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+    if target not in ("arm64", "avx2", "avx512", "avx512_vnni"):
+        raise ValueError(f"Unknown quantization target: {target}")
+    return target, getattr(AutoQuantizationConfig, target)(is_static=False, per_channel=False)
+
+
+def export_int8(model_name, task):
+    # Exports the model to ONNX, quantizes every graph to int8 and caches the
+    # result, so the export only runs the first time a model is used
+    target, config = quantization_config()
+    model_dir = os.path.join(onnx_cache_dir(), model_name.replace("/", "--"), f"{task}-int8-{target}")
+    marker_path = os.path.join(model_dir, "export.json")
+    if os.path.exists(marker_path):
+        return model_dir
+
+    # Workers starting together export once: the rest wait for the lock and
+    # then find the finished export
+    os.makedirs(os.path.dirname(model_dir), exist_ok=True)
+    with file_lock(model_dir + ".lock"):
+        if os.path.exists(marker_path):
+            return model_dir
+        # Built in a uniquely named scratch directory and renamed into place, so
+        # an interrupted export is never mistaken for a finished one
+        scratch_dir = tempfile.mkdtemp(dir=os.path.dirname(model_dir), prefix=os.path.basename(model_dir) + ".",
+                                       suffix=".tmp")
+        try:
+            export_to(model_name, task, config, target, scratch_dir, model_dir)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    return model_dir
+
+
+def export_to(model_name, task, config, target, scratch_dir, model_dir):
+    # Exports and quantizes inside scratch_dir, then moves the int8 model to model_dir
+    import optimum.onnxruntime as ort
+    from optimum.onnxruntime import ORTQuantizer
+    from transformers import AutoTokenizer
+
+    fp32_dir = os.path.join(scratch_dir, "fp32")
+    int8_dir = os.path.join(scratch_dir, "int8")
+    model_class = getattr(ort, ORT_MODEL_CLASSES[task])
+    model_class.from_pretrained(model_name, export=True).save_pretrained(fp32_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(fp32_dir)
+
+    os.makedirs(int8_dir)
+    for file_name in os.listdir(fp32_dir):
+        source = os.path.join(fp32_dir, file_name)
+        if not file_name.endswith(".onnx"):
+            # Configs and tokenizer files are copied as they are
+            if os.path.isfile(source):
+                shutil.copy(source, int8_dir)
+            continue
+        quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name=file_name)
+        quantizer.quantize(save_dir=int8_dir, quantization_config=config)
+        # Keep the original file names so from_pretrained finds the graphs
+        stem = os.path.splitext(file_name)[0]
+        os.replace(os.path.join(int8_dir, f"{stem}_quantized.onnx"), os.path.join(int8_dir, file_name))
+
+    with open(os.path.join(int8_dir, "export.json"), "w") as f:
+        json.dump({"model": model_name, "task": task, "quantization": target}, f)
+    # Only a partial export from a crashed run can be here
+    shutil.rmtree(model_dir, ignore_errors=True)
+    os.replace(int8_dir, model_dir)
+
+
+def load_ort_model(model_name, task):
+    import optimum.onnxruntime as ort
+    from transformers import AutoTokenizer
+    model_dir = export_int8(model_name, task)
+    model = getattr(ort, ORT_MODEL_CLASSES[task]).from_pretrained(model_dir)
+    return model, AutoTokenizer.from_pretrained(model_dir)
+
+
+def load_pipeline(task, model, tokenizer=None, **kwargs):
+    # Drop-in replacement for transformers.pipeline on CPU that serves the
+    # model through the configured backend
+    from transformers import pipeline
+    if inference_backend() == "torch":
+        return pipeline(task, model=model, tokenizer=tokenizer or model, device=-1, **kwargs)
+    ort_model, ort_tokenizer = load_ort_model(model, task)
+    return pipeline(task, model=ort_model, tokenizer=ort_tokenizer, **kwargs)
+
+
+class OnnxSentenceEncoder:
+    # int8 ONNX version of a sentence-transformers model with the same
+    # encode() interface. Mean pooling over tokens followed by L2
+    # normalisation, as in the MiniLM/mpnet sentence-transformers models.
+    def __init__(self, model_name, batch_size=32, max_length=256):
+        # sentence-transformers resolves bare names under its own organisation
+        hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        self.model, self.tokenizer = load_ort_model(hub_name, "feature-extraction")
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def encode(self, texts, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        chunks = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            chunks.append(pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(1e-12))
+        return np.concatenate(chunks).astype(np.float32)
+
+
+def load_sentence_encoder(model_name):
+    # Returns the encoder and the name its embeddings are stored under, which
+    # differs per backend so fp32 and int8 vectors are never mixed in one index
+    if inference_backend() == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name), model_name
+    return OnnxSentenceEncoder(model_name), f"{model_name}:onnx-int8"
+
+
+def faq_questions(faq_path):
+    with open(faq_path) as f:
+        faqs = json.load(f)
+    return [(category, qa['question']) for category, qa_pairs in faqs.items() for qa in qa_pairs]
+
+
+def query_variants(question):
+    # Lowercased, unpunctuated and truncated forms of each FAQ question stand in for real customer phrasing
+    words = question.rstrip("?").split()
+    variants = [question, question.lower().rstrip("?"), " ".join(words[1:])]
+    return [variant for variant in variants if variant]
+
+
+def check_embeddings(model_name, faq_path):
+    from sentence_transformers import SentenceTransformer
+    from faq_index import normalize_rows
+
+    questions = [question for _, question in faq_questions(faq_path)]
+    queries = [variant for question in questions for variant in query_variants(question)]
+    fp32 = SentenceTransformer(model_name)
+    int8 = OnnxSentenceEncoder(model_name)
+
+    fp32_index, int8_index = normalize_rows(fp32.encode(questions)), normalize_rows(int8.encode(questions))
+    fp32_queries, int8_queries = normalize_rows(fp32.encode(queries)), normalize_rows(int8.encode(queries))
+    cosines = np.sum(fp32_queries * int8_queries, axis=1)
+    # Each backend answers the queries against its own index; the answers should be the same FAQ entry
+    agreement = np.mean(np.argmax(fp32_queries @ fp32_index.T, axis=1) == np.argmax(int8_queries @ int8_index.T, axis=1))
+    return {
+        "queries": len(queries),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "top1_agreement": float(agreement),
+    }
+
+
+def check_classifier(model_name, faq_path):
+    from transformers import pipeline
+    questions = [question for _, question in faq_questions(faq_path)]
+    labels = ["billing", "technical", "general"]
+    fp32 = pipeline("zero-shot-classification", model=model_name, device=-1)
+    ort_model, ort_tokenizer = load_ort_model(model_name, "zero-shot-classification")
+    int8 = pipeline("zero-shot-classification", model=ort_model, tokenizer=ort_tokenizer)
+
+    template = "This text is about {}."
+    fp32_labels = [result['labels'][0] for result in fp32(questions, labels, hypothesis_template=template)]
+    int8_labels = [result['labels'][0] for result in int8(questions, labels, hypothesis_template=template)]
+    return {
+        "queries": len(questions),
+        "label_agreement": float(np.mean([a == b for a, b in zip(fp32_labels, int8_labels)])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check int8 ONNX models against their fp32 versions on the FAQ set.")
+    parser.add_argument("--faq", default="knowledge_base/faq.json")
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--classifier-model", default="facebook/bart-large-mnli")
+    parser.add_argument("--skip-classifier", action="store_true", help="only check the embedding model")
+    parser.add_argument("--min-agreement", type=float, default=0.97,
+                        help="lowest acceptable share of queries where int8 and fp32 agree")
+    parser.add_argument("--min-cosine", type=float, default=0.95,
+                        help="lowest acceptable cosine between an int8 and an fp32 embedding")
+    args = parser.parse_args(argv)
+
+    report = {"embedding": check_embeddings(args.embedding_model, args.faq)}
+    failed = (report["embedding"]["top1_agreement"] < args.min_agreement
+              or report["embedding"]["min_cosine"] < args.min_cosine)
+    if not args.skip_classifier:
+        report["classifier"] = check_classifier(args.classifier_model, args.faq)
+        failed = failed or report["classifier"]["label_agreement"] < args.min_agreement
+
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
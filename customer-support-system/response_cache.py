@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query):
+    # "How do I reset password?" and "how do i reset password" share a key
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class ExactCache:
+    # LRU keyed on the normalized query, with entries expiring after ttl seconds
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SemanticCache:
+    # Returns a stored result when a new query embedding is within the cosine
+    # threshold of a cached one. Embeddings live in one preallocated matrix so
+    # a lookup is a single matrix-vector product; the least recently used
+    # slot is reused once the cache is full.
+    def __init__(self, max_size=2000, threshold=0.92):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.matrix = None
+        self.values = [None] * max_size
+        self.slot_order = OrderedDict()
+
+    def get(self, embedding):
+        if self.matrix is None or not self.slot_order:
+            return None
+        similarities = self.matrix @ embedding
+        # Unused slots hold zero vectors and can never reach the threshold
+        best_slot = int(np.argmax(similarities))
+        if similarities[best_slot] < self.threshold or best_slot not in self.slot_order:
+            return None
+        self.slot_order.move_to_end(best_slot)
+        return self.values[best_slot]
+
+    def put(self, embedding, value):
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_size, len(embedding)), dtype=np.float32)
+        if len(self.slot_order) < self.max_size:
+            slot = len(self.slot_order)
+        else:
+            slot, _ = self.slot_order.popitem(last=False)
+        self.matrix[slot] = embedding
+        self.values[slot] = value
+        self.slot_order[slot] = True
+
+    def clear(self):
+        self.matrix = None
+        self.values = [None] * self.max_size
+        self.slot_order.clear()
+
+
+class ResponseCache:
+    def __init__(self, max_size=10000, ttl=3600, semantic_size=2000, semantic_threshold=0.92):
+        self.exact = ExactCache(max_size, ttl)
+        # A threshold of 0 or a size of 0 turns the semantic level off
+        self.semantic = SemanticCache(semantic_size, semantic_threshold) if semantic_size and semantic_threshold else None
+        self.version = None
+        self.lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls):
+        if os.getenv("RESPONSE_CACHE", "1") == "0":
+            return None
+        return cls(
+            max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            semantic_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "2000")),
+            semantic_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        )
+
+    def sync_version(self, version):
+        # Cached answers are dropped whenever the knowledge base changes
+        with self.lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.counters["invalidations"] += 1
+                self.exact.clear()
+                if self.semantic:
+                    self.semantic.clear()
+                self.version = version
+
+    def get_exact(self, key):
+        with self.lock:
+            value = self.exact.get(key)
+            if value is not None:
+                self.counters["exact_hits"] += 1
+            return value
+
+    def get_semantic(self, embedding):
+        with self.lock:
+            value = self.semantic.get(embedding) if self.semantic else None
+            if value is not None:
+                self.counters["semantic_hits"] += 1
+            else:
+                self.counters["misses"] += 1
+            return value
+
+    def record_miss(self):
+        with self.lock:
+            self.counters["misses"] += 1
+
+    def put(self, key, embedding, value, version):
+        with self.lock:
+            # Results computed against a knowledge base that has since changed are not kept
+            if version != self.version:
+                return
+            self.exact.put(key, value)
+            if self.semantic and embedding is not None:
+                self.semantic.put(embedding, value)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["exact_size"] = len(self.exact.entries)
+            stats["semantic_size"] = len(self.semantic.slot_order) if self.semantic else 0
+            return stats
+
+
+class ReviewMemo:
+    # Reviewed versions of knowledge base answers, keyed by a hash of the answer
+    # text plus whatever else the review reads (context). FAQ answers are
+    # fixed, so each one only needs reviewing once per context; an edited
+    # answer hashes differently and gets reviewed afresh.
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get_or_review(self, answer, review, context=()):
+        key = hashlib.sha1("\0".join((answer, *context)).encode("utf-8")).hexdigest()
+        with self.lock:
+            reviewed = self.entries.get(key)
+            if reviewed is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return reviewed
+            self.counters["misses"] += 1
+
+        # Review outside the lock; a concurrent duplicate review is harmless
+        reviewed = review()
+        with self.lock:
+            self.entries[key] = reviewed
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return reviewed
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, size=len(self.entries))
@@ -0,0 +1,465 @@
+import contextlib
+import glob
+import hashlib
+import heapq
+import json
+import math
+import os
+import threading
+import numpy as np
+from compact_store import same_rows
+from file_lock import file_lock, write_atomically
+from lexical_index import BM25Index, reciprocal_rank_fusion, weighted_fusion
+
+
+def load_faiss():
+    # faiss is optional and only imported once an index is large enough to need it
+    try:
+        import faiss
+        return faiss
+    except ImportError:
+        return None
+
+
+# Rows converted to float32 at a time while a quantized matrix is added to a
+# faiss index, and the most rows a quantized index is trained on
+ADD_BLOCK_ROWS = 8192
+TRAIN_SAMPLE_ROWS = 65536
+
+
+class VectorIndex:
+    # Inner-product search over unit-length rows. Large partitions get an
+    # approximate faiss index (HNSW or IVF); small ones, or installs without
+    # faiss, are scored exactly with one matrix product. Quantized matrices get
+    # a scalar-quantized index of the same width, filled block by block, so no
+    # float32 copy of them is ever held.
+    #
+    # With a path, the faiss index is read from that file (memory-mapped) when
+    # it is there, and written to it after a build, so other processes and
+    # later starts skip the build. lock_path serializes the writes across
+    # processes. The path must change whenever the rows or build options do.
+    def __init__(self, vectors, kind="hnsw", min_ann_size=1000, hnsw_m=32, ef_search=64,
+                 nlist=None, nprobe=8, path=None, lock_path=None):
+        self.vectors = vectors
+        self.size = len(vectors)
+        self.index = None
+        self.saved = False
+
+        if kind not in ("hnsw", "ivf", "exact"):
+            raise ValueError(f"Unknown index kind: {kind}")
+        if kind == "exact" or self.size < min_ann_size:
+            return
+        faiss = load_faiss()
+        if faiss is None:
+            return
+
+        build = lambda: self.build(faiss, kind, hnsw_m, nlist)
+        if path is None:
+            index = build()
+        else:
+            index = self.load_or_build(faiss, path, lock_path, build)
+        # Search-time settings aren't part of the saved index's identity
+        if kind == "hnsw":
+            faiss.downcast_index(index).hnsw.efSearch = ef_search
+        else:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        self.index = index
+
+    def build(self, faiss, kind, hnsw_m, nlist):
+        vectors = self.vectors
+        quantized = hasattr(vectors, "dequantize")
+        dim = vectors.shape[1]
+        if quantized:
+            code = faiss.ScalarQuantizer.QT_fp16 if vectors.dtype == "float16" else faiss.ScalarQuantizer.QT_8bit
+        if kind == "hnsw":
+            if quantized:
+                index = faiss.IndexHNSWSQ(dim, code, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            nlist = nlist or max(1, int(math.sqrt(self.size)))
+            quantizer = faiss.IndexFlatIP(dim)
+            if quantized:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, code, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            # Keep a reference so the quantizer outlives this scope
+            self.quantizer = quantizer
+
+        if not quantized:
+            data = np.ascontiguousarray(vectors, dtype=np.float32)
+            if not index.is_trained:
+                index.train(data)
+            index.add(data)
+        else:
+            if not index.is_trained:
+                # An evenly spaced sample is enough to fit the value ranges and clusters
+                step = max(1, self.size // TRAIN_SAMPLE_ROWS)
+                index.train(np.ascontiguousarray(vectors.dequantize(slice(0, None, step))))
+            for start in range(0, self.size, ADD_BLOCK_ROWS):
+                index.add(np.ascontiguousarray(vectors.dequantize(slice(start, start + ADD_BLOCK_ROWS))))
+        return index
+
+    def load_or_build(self, faiss, path, lock_path, build):
+        lock_path = lock_path or path + ".lock"
+        with file_lock(lock_path, shared=True):
+            index = self.load_saved(faiss, path)
+        if index is not None:
+            return index
+        # Only one process builds; the others find its file once they get the lock
+        with file_lock(lock_path):
+            index = self.load_saved(faiss, path)
+            if index is not None:
+                return index
+            index = build()
+            self.write(faiss, index, path)
+        return index
+
+    def save_as(self, path, lock_path=None):
+        # Saves an index carried over to a new version under that version's name
+        if self.index is None or path is None or os.path.exists(path):
+            return
+        with file_lock(lock_path or path + ".lock"):
+            if not os.path.exists(path):
+                self.write(load_faiss(), self.index, path)
+
+    def write(self, faiss, index, path):
+        try:
+            write_atomically(path, lambda f: faiss.write_index(index, faiss.PyCallbackIOWriter(f.write)))
+            self.saved = True
+        except OSError as e:
+            print(f"Error saving vector index: {e}")
+
+    def load_saved(self, faiss, path):
+        # The saved index if it is readable and covers these rows, otherwise None
+        if not os.path.exists(path):
+            return None
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError as e:
+            print(f"Rebuilding unreadable vector index: {e}")
+            return None
+        if index.ntotal != self.size or index.d != self.vectors.shape[1]:
+            print(f"Rebuilding vector index: {index.ntotal} rows saved for {self.size}")
+            return None
+        return index
+
+    @property
+    def nbytes(self):
+        # Memory held by the faiss index itself, on top of the matrix it was built from
+        if self.index is None:
+            return 0
+        return int(load_faiss().serialize_index(self.index).nbytes)
+
+    def search(self, query_vectors, k):
+        # Returns (scores, ids), each of shape (len(query_vectors), k); ids of -1 mark empty slots
+        k = min(k, self.size)
+        if k == 0:
+            empty = np.zeros((len(query_vectors), 0))
+            return empty, empty.astype(np.int64)
+
+        if self.index is not None:
+            return self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), k)
+
+        similarities = inner_products(query_vectors, self.vectors)
+        if k < self.size:
+            ids = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            ids = np.tile(np.arange(self.size), (len(query_vectors), 1))
+        scores = np.take_along_axis(similarities, ids, axis=1)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def inner_products(query_vectors, vectors):
+    # Quantized matrices score on their compact data instead of a float32 copy
+    if hasattr(vectors, "inner_products"):
+        return vectors.inner_products(query_vectors)
+    return query_vectors @ vectors.T
+
+
+def document_key(category, text):
+    # Compact key for a (category, text) pair, so the lexical index holds no copy of the text
+    digest = hashlib.blake2b(f"{category}\0{text}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class PartitionedRetriever:
+    # One index per category plus a global index for fallback. Rows of the
+    # matrix must be unit length and grouped by category, with offsets giving
+    # each category's (start, end) span and items holding the payload per row.
+    # The global index is only built the first time a search falls back to it.
+    #
+    # With save_prefix, the faiss indexes are kept in files named after it,
+    # version (which must change whenever the rows do) and the build options,
+    # so they are built once per knowledge base version rather than once per
+    # process. Files of other versions are deleted after a save.
+    def __init__(self, matrix, offsets, items, previous=None, save_prefix=None, version=None,
+                 lock_path=None, **index_options):
+        self.matrix = matrix
+        self.offsets = offsets
+        self.items = items
+        self.index_options = index_options
+        self.save_prefix = save_prefix
+        self.version = version
+        self.lock_path = lock_path
+        self._global_index = None
+        self._global_lock = threading.Lock()
+        # Carried over only if it was built, and from exactly these rows
+        previous_global = previous._global_index if previous is not None else None
+        if previous_global is not None and same_rows(previous_global.vectors, matrix):
+            self._global_index = previous_global
+        self.category_indexes = {}
+        for category, (start, end) in offsets.items():
+            if end > start:
+                index = previous and previous.reusable_index(category, matrix[start:end])
+                if index is not None:
+                    index.save_as(self.saved_path(category), self.lock_path)
+                else:
+                    index = self.new_index(category, matrix[start:end])
+                self.category_indexes[category] = index
+        if any(index.saved for index in self.category_indexes.values()):
+            self.prune_saved()
+
+    def new_index(self, category, vectors):
+        return VectorIndex(vectors, path=self.saved_path(category), lock_path=self.lock_path,
+                           **self.index_options)
+
+    def saved_path(self, category):
+        # File for the index of a category (None for the global index), or None if indexes aren't saved
+        if self.save_prefix is None:
+            return None
+        options = {key: self.index_options.get(key) for key in ("kind", "hnsw_m", "nlist")}
+        key = hashlib.blake2b(
+            json.dumps([category, str(self.matrix.dtype), options], sort_keys=True).encode('utf-8'),
+            digest_size=8
+        ).hexdigest()
+        return f"{self.save_prefix}.{self.version[:16]}.{key}.faiss"
+
+    def prune_saved(self):
+        current = f"{os.path.basename(self.save_prefix)}.{self.version[:16]}."
+        with file_lock(self.lock_path or self.save_prefix + ".lock"):
+            for path in glob.glob(glob.escape(self.save_prefix) + ".*.faiss"):
+                if not os.path.basename(path).startswith(current):
+                    with contextlib.suppress(OSError):
+                        os.remove(path)
+
+    @property
+    def global_index(self):
+        if self._global_index is None:
+            with self._global_lock:
+                if self._global_index is None:
+                    self._global_index = self.new_index(None, self.matrix)
+        return self._global_index
+
+    @property
+    def categories(self):
+        # Categories with an index of their own
+        return list(self.category_indexes)
+
+    def reusable_index(self, category, vectors):
+        # The existing index for a category, if it was built from exactly these rows
+        index = self.category_indexes.get(category)
+        if index is not None and same_rows(index.vectors, vectors):
+            return index
+        return None
+
+    def search(self, query_vector, category=None, k=3, fallback=True, query_text=None):
+        return self.search_batch(np.asarray(query_vector).reshape(1, -1), [category], k, fallback)[0]
+
+    def search_batch(self, query_vectors, categories, k=3, fallback=True, query_texts=None):
+        # Returns a list of [(item, score), ...] per query, best first
+        return [
+            [(self.items[row], score) for row, score in hits]
+            for hits in self.search_rows_batch(query_vectors, categories, k, fallback)
+        ]
+
+    def partition(self, category, fallback=True):
+        # Key of the index a query for this category goes to: the category, None
+        # for the global index, or False when there is nothing to search
+        if category in self.category_indexes:
+            return category
+        if fallback or category is None:
+            return None
+        return False
+
+    def partition_range(self, partition):
+        if partition is None:
+            return 0, len(self.items)
+        return self.offsets[partition]
+
+    def search_rows_batch(self, query_vectors, categories, k=3, fallback=True):
+        # Like search_batch, but with matrix row numbers in place of items
+        results = [[] for _ in categories]
+
+        # Queries for the same category are searched together in one call
+        groups = {}
+        for i, category in enumerate(categories):
+            partition = self.partition(category, fallback)
+            if partition is not False:
+                groups.setdefault(partition, []).append(i)
+
+        for category, positions in groups.items():
+            if category is None:
+                index, start = self.global_index, 0
+            else:
+                index, start = self.category_indexes[category], self.offsets[category][0]
+            scores, ids = index.search(query_vectors[positions], k)
+            for position, row_scores, row_ids in zip(positions, scores, ids):
+                results[position] = [
+                    (start + int(row_id), float(score))
+                    for score, row_id in zip(row_scores, row_ids)
+                    if row_id >= 0
+                ]
+        return results
+
+
+class HybridRetriever:
+    # Combines a PartitionedRetriever with a BM25 index over the same rows, so
+    # exact identifiers (error codes, plan names) that embeddings blur still
+    # rank their entry first. Hits are ranked by the fused score but report
+    # their cosine similarity, so similarity thresholds keep their meaning.
+    #
+    # BM25 documents are keyed by a hash of (category, text) rather than row
+    # number, so a new knowledge base version only tokenizes the entries that changed.
+    def __init__(self, dense, texts, categories, previous=None, fusion="rrf", dense_weight=0.5,
+                 candidates=20, prefilter=False):
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        self.dense = dense
+        self.items = dense.items
+        self.fusion = fusion
+        self.dense_weight = dense_weight
+        self.candidates = candidates
+        # Only score the lexical candidates densely when there are any; this
+        # skips the vector search at the cost of paraphrases with no shared terms
+        self.prefilter = prefilter
+
+        if previous is not None:
+            lexical = previous.lexical.copy()
+        else:
+            lexical = BM25Index()
+        self.row_of = {}
+        for row, (category, text) in enumerate(zip(categories, texts)):
+            key = document_key(category, text)
+            if key in self.row_of:
+                continue
+            self.row_of[key] = row
+            if key not in lexical:
+                lexical.add(key, text)
+        for key in [key for key in lexical.documents if key not in self.row_of]:
+            lexical.remove(key)
+        self.lexical = lexical
+
+    @property
+    def categories(self):
+        return self.dense.categories
+
+    def search(self, query_vector, category=None, k=3, fallback=True, query_text=None):
+        query_texts = None if query_text is None else [query_text]
+        return self.search_batch(np.asarray(query_vector).reshape(1, -1), [category], k, fallback, query_texts)[0]
+
+    def search_batch(self, query_vectors, categories, k=3, fallback=True, query_texts=None):
+        if query_texts is None:
+            return self.dense.search_batch(query_vectors, categories, k, fallback)
+
+        lexical_hits = []
+        needs_dense = []
+        # BM25 scoring walks the postings of every query term across the whole
+        # knowledge base, so each distinct text is scored once and its rows are
+        # then split by partition, however many categories it is searched in
+        scored = {}
+        for i, (category, query_text) in enumerate(zip(categories, query_texts)):
+            partition = self.dense.partition(category, fallback)
+            if partition is False:
+                lexical_hits.append([])
+                continue
+            if query_text not in scored:
+                scored[query_text] = [(self.row_of[key], score)
+                                      for key, score in self.lexical.scores(query_text).items()]
+            start, end = self.dense.partition_range(partition)
+            hits = heapq.nlargest(self.candidates, (hit for hit in scored[query_text] if start <= hit[0] < end),
+                                  key=lambda hit: hit[1])
+            lexical_hits.append(hits)
+            if not (self.prefilter and hits):
+                needs_dense.append(i)
+
+        dense_hits = [[] for _ in categories]
+        if needs_dense:
+            found = self.dense.search_rows_batch(
+                query_vectors[needs_dense], [categories[i] for i in needs_dense], self.candidates, fallback)
+            for i, hits in zip(needs_dense, found):
+                dense_hits[i] = hits
+
+        results = []
+        for query_vector, lexical, dense in zip(query_vectors, lexical_hits, dense_hits):
+            results.append(self.fuse(query_vector, lexical, dense, k))
+        return results
+
+    def fuse(self, query_vector, lexical_hits, dense_hits, k):
+        # Both hit lists are (row, score) pairs, best first
+        lexical_rows = [row for row, _ in lexical_hits]
+        cosines = dict(dense_hits)
+        missing = [row for row in lexical_rows if row not in cosines]
+        if missing:
+            # Rows found only lexically still get their exact similarity
+            for row, score in zip(missing, self.dense.matrix[missing] @ query_vector):
+                cosines[row] = float(score)
+        if not cosines:
+            return []
+
+        dense_ranking = sorted(cosines, key=cosines.get, reverse=True)
+        if self.fusion == "rrf":
+            fused = reciprocal_rank_fusion([dense_ranking, lexical_rows])
+        else:
+            fused = weighted_fusion(cosines, dict(lexical_hits), self.dense_weight)
+        best = sorted(fused, key=lambda row: (fused[row], cosines[row]), reverse=True)[:k]
+        return [(self.items[row], cosines[row]) for row in best]
+
+
+def retriever_from_env(matrix, offsets, items, previous=None, texts=None, **saving):
+    # texts holds the searchable text of each row. Keyword scoring grows with
+    # the size of the knowledge base, so hybrid retrieval is opt-in: it needs
+    # the texts and RETRIEVAL_FUSION=rrf or weighted. saving holds the
+    # save_prefix, version and lock_path of PartitionedRetriever.
+    fusion = os.getenv("RETRIEVAL_FUSION", "dense")
+    hybrid = texts is not None and fusion != "dense"
+    if isinstance(previous, HybridRetriever):
+        previous_dense, previous_hybrid = previous.dense, previous
+    else:
+        previous_dense, previous_hybrid = previous, None
+
+    dense = dense_retriever_from_env(matrix, offsets, items, previous_dense, **saving)
+    if not hybrid:
+        return dense
+    categories = [None] * len(items)
+    for category, (start, end) in offsets.items():
+        categories[start:end] = [category] * (end - start)
+    return HybridRetriever(
+        dense,
+        texts,
+        categories,
+        previous=previous_hybrid,
+        fusion=fusion,
+        dense_weight=float(os.getenv("RETRIEVAL_DENSE_WEIGHT", "0.5")),
+        candidates=int(os.getenv("RETRIEVAL_CANDIDATES", "20")),
+        prefilter=os.getenv("RETRIEVAL_PREFILTER", "0") == "1"
+    )
+
+
+def dense_retriever_from_env(matrix, offsets, items, previous=None, **saving):
+    # Recall/latency knobs for the ANN indexes
+    nlist = os.getenv("RETRIEVAL_NLIST")
+    return PartitionedRetriever(
+        matrix,
+        offsets,
+        items,
+        previous=previous,
+        **saving,
+        kind=os.getenv("RETRIEVAL_INDEX", "hnsw"),
+        min_ann_size=int(os.getenv("RETRIEVAL_MIN_ANN_SIZE", "1000")),
+        hnsw_m=int(os.getenv("RETRIEVAL_HNSW_M", "32")),
+        ef_search=int(os.getenv("RETRIEVAL_EF_SEARCH", "64")),
+        nlist=int(nlist) if nlist else None,
+        nprobe=int(os.getenv("RETRIEVAL_NPROBE", "8"))
+    )
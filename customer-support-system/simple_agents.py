@@ -1,7 +1,8 @@
-import json
 import re
-from sentence_transformers import SentenceTransformer, util
 import numpy as np
+from faq_index import FAQIndex
+from keyword_matcher import KeywordMatcher
+from embedding_batcher import batched_encoder
 
 class SimpleClassifierAgent:
     def __init__(self):
@@ -10,69 +11,214 @@ class SimpleClassifierAgent:
             "technical": ["password", "login", "crash", "error", "bug", "feature", "update", "install", "technical"],
             "general": ["hours", "contact", "support", "help", "information", "about"]
         }
+        # Compiled once so every category is scored in a single pass over the query
+        self.matcher = KeywordMatcher(self.keywords)
+    
+    def score_query(self, query):
+        return self.matcher.score(query)
     
     def classify_query(self, query):
-        query_lower = query.lower()
-        scores = {category: 0 for category in self.keywords.keys()}
-        
-        for category, words in self.keywords.items():
-            for word in words:
-                if word in query_lower:
-                    scores[category] += 1
+        scores = self.score_query(query)
         
         # Return category with highest score, default to general
         return max(scores, key=scores.get) if max(scores.values()) > 0 else "general"
+    
+    def fallback_category(self, query):
+        # Keyword scoring is all this agent does, so its best guess is its answer
+        return self.classify_query(query)
+    
+    def classify_with_tier(self, query):
+        return self.classify_query(query), "keyword"
+    
+    def classify_inline(self, query):
+        # Keyword scoring is cheap enough to run on the request thread
+        return self.classify_with_tier(query)
+    
+    def classify_batch(self, queries):
+        return [self.classify_query(query) for query in queries]
+    
+    def classify_batch_with_tier(self, queries):
+        return [(self.classify_query(query), "keyword") for query in queries]
 
 class SimpleResponseAgent:
     def __init__(self):
-        self.embeddings = SentenceTransformer('all-MiniLM-L6-v2')
-        self.knowledge_base = self.load_knowledge_base()
+        # Imported here so loading this module doesn't pull in torch
+        from onnx_backend import load_sentence_encoder
+        
+        # fp32 SentenceTransformer, or its int8 ONNX export with INFERENCE_BACKEND=onnx
+        self.embeddings, model_name = load_sentence_encoder('all-MiniLM-L6-v2')
+        # Concurrent queries share encoder calls through a micro-batcher
+        self.encoder = batched_encoder(self.embeddings)
+        # FAQ questions are embedded once and persisted next to faq.json
+        self.faq_index = FAQIndex(self.encoder, model_name)
+    
+    @property
+    def knowledge_base_version(self):
+        return self.faq_index.snapshot.faq_hash
     
-    def load_knowledge_base(self):
-        with open('knowledge_base/faq.json', 'r') as f:
-            return json.load(f)
+    @property
+    def faq_path(self):
+        return self.faq_index.faq_path
     
-    def generate_response(self, query, category):
+    def reload_knowledge_base(self):
+        return self.faq_index.reload()
+    
+    def embed_query(self, query):
+        return self.faq_index.encode_query(query)
+    
+    def is_knowledge_base_answer(self, response):
+        return self.faq_index.snapshot.is_answer(response)
+    
+    def retrieve(self, query, query_embedding=None):
+        # Best match in every category, so retrieval can run before the
+        # category is known; generate_response then picks the one it needs
+        snapshot = self.faq_index.snapshot
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        categories = [category for category in snapshot.offsets if snapshot.has_category(category)]
+        matches = snapshot.best_matches(np.tile(query_embedding, (len(categories), 1)), categories,
+                                        [query] * len(categories))
+        return {"snapshot": snapshot, "embedding": query_embedding, "matches": dict(zip(categories, matches))}
+    
+    def generate_response(self, query, category, query_embedding=None, retrieval=None):
         try:
-            # Get FAQs for the category
-            faqs = self.knowledge_base.get(category, [])
+            # An earlier retrieve() result is answered from the snapshot it searched
+            snapshot = retrieval["snapshot"] if retrieval else self.faq_index.snapshot
             
-            if not faqs:
+            # Check the category has FAQs
+            if not snapshot.has_category(category):
                 return "I don't have information on that topic. Please contact our support team."
             
-            # Find the most similar question
-            questions = [qa['question'] for qa in faqs]
-            question_embeddings = self.embeddings.encode(questions)
-            query_embedding = self.embeddings.encode([query])
-            
-            # Calculate similarity
-            similarities = util.cos_sim(query_embedding, question_embeddings)[0]
-            most_similar_idx = np.argmax(similarities)
-            
-            # Return the answer if similarity is high enough
-            if similarities[most_similar_idx] > 0.3:
-                return faqs[most_similar_idx]['answer']
+            # Find the most similar question against the precomputed matrix
+            if retrieval:
+                best_faq, similarity = retrieval["matches"][category]
             else:
-                return f"I'm not sure about that specific question. For {category} issues, you can contact our support team."
+                if query_embedding is None:
+                    query_embedding = self.embed_query(query)
+                best_faq, similarity = snapshot.best_match(query_embedding, category, query)
+            
+            return self.answer_for_match(category, best_faq, similarity)
         except Exception as e:
             print(f"Error generating response: {e}")
             return "I apologize, but I'm experiencing technical difficulties."
+    
+    def stream_response(self, query, category, query_embedding=None, retrieval=None, deadline=None):
+        # Knowledge base answers are ready at once, so they arrive as a single chunk
+        yield self.generate_response(query, category, query_embedding=query_embedding, retrieval=retrieval)
+    
+    def generate_batch(self, queries, categories):
+        try:
+            snapshot = self.faq_index.snapshot
+            
+            # One encoder call and one similarity matrix for the whole batch
+            query_embeddings = self.faq_index.encode_queries(queries)
+            matches = snapshot.best_matches(query_embeddings, categories, list(queries))
+            
+            responses = []
+            for category, (best_faq, similarity) in zip(categories, matches):
+                if not snapshot.has_category(category):
+                    responses.append("I don't have information on that topic. Please contact our support team.")
+                else:
+                    responses.append(self.answer_for_match(category, best_faq, similarity))
+            return responses
+        except Exception as e:
+            print(f"Error generating batch responses: {e}")
+            return ["I apologize, but I'm experiencing technical difficulties."] * len(queries)
+    
+    def fallback_response(self, query, category, query_embedding=None, retrieval=None):
+        # Used when a stage can't finish within the request's deadline: the
+        # closest answer retrieval already found, otherwise a lookup that
+        # doesn't need the encoder, and a template only when nothing matches
+        if retrieval and category in retrieval["matches"]:
+            return self.answer_for_match(category, *retrieval["matches"][category])
+        try:
+            snapshot = self.faq_index.snapshot
+            if query_embedding is not None:
+                return self.answer_for_match(category, *snapshot.best_match(query_embedding, category))
+            best_faq, _ = snapshot.lexical_match(query, category)
+            if best_faq is not None:
+                return best_faq['answer']
+        except Exception as e:
+            print(f"Error retrieving fallback response: {e}")
+        return self.template_response(category)
+    
+    def answer_for_match(self, category, best_faq, similarity):
+        # Return the answer if similarity is high enough
+        if best_faq is not None and similarity > 0.3:
+            return best_faq['answer']
+        else:
+            return self.template_response(category)
+    
+    def template_response(self, category):
+        return f"I'm not sure about that specific question. For {category} issues, you can contact our support team."
+
+def lower_same_length(text):
+    # Lowercase text whose offsets still line up with the original; the few
+    # characters that lowercase to several (e.g. "İ") are left as they are
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+
+def redact_spans(text, spans, replacement="[redacted]"):
+    # Replaces each (start, end) span, merging spans that overlap
+    parts = []
+    position = 0
+    last_start = last_end = None
+    for start, end in sorted(spans):
+        if last_end is not None and start < last_end:
+            last_end = max(last_end, end)
+            continue
+        if last_end is not None:
+            parts.append(text[position:last_start])
+            parts.append(replacement)
+            position = last_end
+        last_start, last_end = start, end
+    parts.append(text[position:last_start])
+    parts.append(replacement)
+    parts.append(text[last_end:])
+    return "".join(parts)
+
 
 class SimpleReviewAgent:
     def __init__(self):
         self.positive_phrases = ["thank you", "please", "apologize", "sorry", "happy to help", "assist", "support"]
         self.negative_phrases = ["idiot", "stupid", "hate", "worthless", "useless", "terrible"]
+        self.closing_phrases = ["thank you", "please", "contact support"]
+        # Both lists in one automaton, so a single scan finds what to redact and
+        # whether there is a closing, however long the lists get. Negative
+        # phrases must start a word, so "hateful" and "idiots" are redacted
+        # but "whatever" keeps its "hate"; closings count anywhere.
+        self.matcher = KeywordMatcher({"negative": self.negative_phrases, "closing": self.closing_phrases},
+                                      word_start=["negative"])
     
     def review_response(self, query, category, response):
-        # Simple tone check - just make sure it doesn't contain negative phrases
-        response_lower = response.lower()
+        # Simple tone check - redact negative phrases in any letter case
+        redact = []
+        has_closing = False
+        for start, end, keyword_id in self.matcher.iter_matches(lower_same_length(response)):
+            if self.matcher.keyword_info[keyword_id][0] == "negative":
+                redact.append((start, end))
+            else:
+                has_closing = True
         
-        for phrase in self.negative_phrases:
-            if phrase in response_lower:
-                response = response.replace(phrase, "[redacted]")
+        if redact:
+            response = redact_spans(response, redact)
         
         # Ensure it has a professional closing
-        if not any(phrase in response_lower for phrase in ["thank you", "please", "contact support"]):
+        if not has_closing:
             response += " Please contact our support team if you need further assistance."
         
-        return response
\ No newline at end of file
+        return response
+    
+    def review_answer(self, category, response):
+        # Reviews only look at the response text, so the query doesn't matter
+        return self.review_response("", category, response)
+    
+    def stream_review(self, query, category, response, deadline=None):
+        yield self.review_response(query, category, response)
+    
+    def review_batch(self, queries, categories, responses):
+        return [self.review_response(query, category, response)
+                for query, category, response in zip(queries, categories, responses)]
@@ -1,6 +1,18 @@
 import streamlit as st
 import json
+import os
 import re
+from chat_history import ChatHistory, render_history
+from lexical_index import BM25Index, tokenize
+
+# A knowledge base match needs a shared word of more than this many letters,
+# like the original keyword matcher, that is also in at most this share of
+# the questions; the share keeps the rule relative to the size of the corpus
+MIN_MATCH_WORD_LENGTH = 4
+MAX_MATCH_DOC_SHARE = 0.25
+
+# Messages drawn on each rerun; older ones are shown on request
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "20"))
 
 # Set page configuration
 st.set_page_config(
@@ -85,16 +97,20 @@ class SimpleResponseAgent:
                 {"question": "Where can I find tutorials?", "answer": "We have a comprehensive knowledge base at help.company.com."}
             ]
         }
+        # BM25 over the questions, keyed by (category, position). Answers are
+        # left out: words like "help" in a URL would match almost any query.
+        self.index = BM25Index()
+        for category, faqs in self.knowledge_base.items():
+            for i, faq in enumerate(faqs):
+                self.index.add((category, i), faq['question'])
     
     def generate_response(self, query, category):
-        query_lower = query.lower()
-        faqs = self.knowledge_base.get(category, [])
-        
-        # Try to find a matching question
-        for faq in faqs:
-            for keyword in faq["question"].lower().split():
-                if keyword in query_lower and len(keyword) > 4:  # Only longer keywords
-                    return faq["answer"]
+        # Best-scoring entry of the category, looked up through the inverted index.
+        # Short or common shared words alone ("the app") get the default.
+        hits = self.index.search(query, k=1, doc_filter=lambda key: key[0] == category)
+        if hits and self.is_distinctive_match(query, hits[0][0]):
+            (_, i), _ = hits[0]
+            return self.knowledge_base[category][i]["answer"]
         
         # Default responses
         default_responses = {
@@ -104,6 +120,12 @@ class SimpleResponseAgent:
         }
         
         return default_responses.get(category, "Thank you for your message. Our team will respond shortly.")
+    
+    def is_distinctive_match(self, query, key):
+        terms, _ = self.index.documents[key]
+        max_frequency = MAX_MATCH_DOC_SHARE * len(self.index)
+        return any(len(term) > MIN_MATCH_WORD_LENGTH and self.index.document_frequency(term) <= max_frequency
+                   for term in set(tokenize(query)) & terms)
 
 # Simple review agent
 class SimpleReviewAgent:
@@ -117,12 +139,13 @@ class SimpleReviewAgent:
             
         return response
 
-# Initialize the simple agents
-classifier = SimpleClassifierAgent()
-response_agent = SimpleResponseAgent()
-review_agent = SimpleReviewAgent()
+@st.cache_resource
+def local_agents():
+    # Built once per server process, not on every rerun
+    return SimpleClassifierAgent(), SimpleResponseAgent(), SimpleReviewAgent()
 
 def process_query_simple(query):
+    classifier, response_agent, review_agent = local_agents()
     category = classifier.classify_query(query)
     draft_response = response_agent.generate_response(query, category)
     final_response = review_agent.review_response(query, category, draft_response)
@@ -135,12 +158,7 @@ def process_query_simple(query):
 st.title("🤖 Multi-Agent Customer Support System")
 st.write("This system uses multiple AI agents to classify, respond to, and review customer support queries.")
 
-# Initialize chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-# Display chat messages from history on app rerun
-for message in st.session_state.messages:
+def render_message(message):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if message["role"] == "assistant" and "category" in message:
@@ -148,6 +166,15 @@ for message in st.session_state.messages:
             st.markdown(f'<span class="category-badge {badge_class}">Category: {message["category"]}</span>', 
                        unsafe_allow_html=True)
 
+# Initialize chat history; only recent messages are kept in memory
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistory()
+history = st.session_state.history
+# Messages past the age cap move to disk even when nothing new is sent
+history.spill()
+
+render_history(st, history, CHAT_WINDOW, render_message)
+
 # React to user input
 if prompt := st.chat_input("What can I help you with today?"):
     # Display user message in chat message container
@@ -155,7 +182,7 @@ if prompt := st.chat_input("What can I help you with today?"):
         st.markdown(prompt)
     
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history.append({"role": "user", "content": prompt})
     
     # Process the query
     with st.spinner('Processing your query with our multi-agent system...'):
@@ -169,7 +196,7 @@ if prompt := st.chat_input("What can I help you with today?"):
                        unsafe_allow_html=True)
         
         # Add assistant response to chat history
-        st.session_state.messages.append({
+        history.append({
             "role": "assistant", 
             "content": result["response"],
             "category": result["category"]
@@ -192,7 +219,7 @@ with st.sidebar:
     """)
     
     if st.button("Clear Conversation"):
-        st.session_state.messages = []
+        history.clear()
         st.rerun()
 
 # Test queries suggestion
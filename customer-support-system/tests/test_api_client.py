@@ -0,0 +1,84 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from api_client import SupportAPIClient
+
+
+class FakeAPI(BaseHTTPRequestHandler):
+    # /ready answers with the server's ready status; the stream endpoint sends one result
+    def do_GET(self):
+        self.send_response(200 if self.server.ready else 503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.posts += 1
+        body = b'event: category\ndata: "billing"\n\nevent: done\ndata: {"response": "ok"}\n\n'
+        self.send_response(200 if self.server.ready else 503)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAPI)
+    server.ready = True
+    server.posts = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(server, **kwargs):
+    return SupportAPIClient(base_url=f"http://127.0.0.1:{server.server_port}", **kwargs)
+
+
+def test_stream_yields_events(server):
+    client = client_for(server)
+    assert list(client.stream_query("hi")) == [("category", "billing"), ("done", {"response": "ok"})]
+    assert client.available
+
+
+def test_circuit_opens_after_repeated_failures(server):
+    server.ready = False
+    client = client_for(server, failure_threshold=2, probe_interval=60)
+    assert list(client.stream_query("hi")) == []
+    assert client.available
+    assert list(client.stream_query("hi")) == []
+    assert not client.available
+
+    # An open circuit fails at once without calling the API
+    posts = server.posts
+    assert list(client.stream_query("hi")) == []
+    assert server.posts == posts
+
+
+def test_circuit_closes_once_the_api_is_ready(server):
+    server.ready = False
+    client = client_for(server, failure_threshold=1, probe_interval=0.05)
+    list(client.stream_query("hi"))
+    assert not client.available
+
+    server.ready = True
+    for _ in range(100):
+        if client.available:
+            break
+        time.sleep(0.05)
+    assert client.available
+    assert list(client.stream_query("hi"))[-1] == ("done", {"response": "ok"})
+
+
+def test_unreachable_api_counts_as_a_failure():
+    client = SupportAPIClient(base_url="http://127.0.0.1:9", failure_threshold=1, probe_interval=60)
+    assert list(client.stream_query("hi")) == []
+    assert not client.available
@@ -0,0 +1,40 @@
+import json
+
+from bulk import chunked, read_checkpoint, read_tickets, resume_output, write_checkpoint
+
+
+def test_read_tickets_handles_jsonl_and_csv(tmp_path):
+    jsonl = tmp_path / "tickets.jsonl"
+    jsonl.write_text('{"query": "a"}\n\n{"query": "b"}\n')
+    csv = tmp_path / "tickets.csv"
+    csv.write_text("id,query\n1,a\n2,b\n")
+    assert [ticket["query"] for ticket in read_tickets(str(jsonl))] == ["a", "b"]
+    assert [ticket["query"] for ticket in read_tickets(str(csv))] == ["a", "b"]
+
+
+def test_chunked_keeps_the_short_last_chunk():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_missing_checkpoint_starts_from_the_beginning(tmp_path):
+    assert read_checkpoint(str(tmp_path / "missing")) == {"offset": 0, "output_bytes": 0}
+
+
+def test_resume_drops_output_written_after_the_checkpoint(tmp_path):
+    output = tmp_path / "out.jsonl"
+    checkpoint = str(tmp_path / "out.jsonl.checkpoint")
+    done = json.dumps({"query": "a"}) + "\n"
+    output.write_text(done)
+    write_checkpoint(checkpoint, 1, len(done.encode("utf-8")))
+    # A crash after writing part of the next chunk but before checkpointing it
+    with open(output, "a") as f:
+        f.write('{"query": "b"}\n{"que')
+
+    assert resume_output(str(output), checkpoint) == (1, "ab")
+    assert output.read_text() == done
+
+
+def test_resume_without_output_starts_a_new_file(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    write_checkpoint(checkpoint, 3, 100)
+    assert resume_output(str(tmp_path / "missing.jsonl"), checkpoint) == (3, "wb")
@@ -0,0 +1,60 @@
+import pytest
+
+from chat_history import ChatHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    return ChatHistory(path=str(tmp_path / "history.sqlite3"), max_messages=3)
+
+
+def fill(history, count):
+    for i in range(count):
+        history.append({"role": "user", "content": str(i)})
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+def test_messages_past_the_cap_move_to_disk(history):
+    fill(history, 7)
+    assert len(history) == 7
+    assert len(history.recent) == 3
+    assert history.archived == 4
+    assert contents(history.messages()) == [str(i) for i in range(7)]
+    assert contents(history.messages(2, 5)) == ["2", "3", "4"]
+    assert contents(history.tail(2)) == ["5", "6"]
+
+
+def test_old_messages_spill_by_age(tmp_path):
+    history = ChatHistory(path=str(tmp_path / "history.sqlite3"), max_messages=10, max_age=60)
+    fill(history, 2)
+    created, message = history.recent[0]
+    history.recent[0] = (created - 120, message)
+    history.spill()
+    assert history.archived == 1
+    assert contents(history.messages()) == ["0", "1"]
+
+
+def test_pages_count_back_from_the_live_window(history):
+    fill(history, 11)
+    # 11 messages, a window of 4: pages of 4 and 3 before the last 4
+    assert history.page_count(4) == 2
+    assert contents(history.page(2, 4)) == ["3", "4", "5", "6"]
+    assert contents(history.page(1, 4)) == ["0", "1", "2"]
+    assert contents(history.tail(4)) == ["7", "8", "9", "10"]
+
+
+def test_no_pages_within_the_window(history):
+    fill(history, 2)
+    assert history.page_count(4) == 0
+
+
+def test_clear_removes_archived_messages(history):
+    fill(history, 5)
+    history.clear()
+    assert len(history) == 0
+    assert history.messages() == []
+    fill(history, 1)
+    assert contents(history.messages()) == ["0"]
@@ -0,0 +1,121 @@
+import hashlib
+import json
+
+import numpy as np
+import pytest
+
+from compact_store import QuantizedMatrix
+from faq_index import FAQIndex
+
+FAQS = {
+    "billing": [
+        {"question": "How do I update my payment method?", "answer": "Go to Billing > Payment Methods."},
+        {"question": "When will I be charged?", "answer": "On the day you signed up."},
+    ],
+    "technical": [
+        {"question": "How do I reset my password?", "answer": "Click 'Forgot Password'."},
+    ],
+}
+
+
+class HashEncoder:
+    # Deterministic embeddings that records every text it is asked to encode
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        rows = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            rows.append(np.random.default_rng(seed).normal(size=16))
+        return np.asarray(rows, dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def dense_retrieval(monkeypatch):
+    monkeypatch.setenv("RETRIEVAL_FUSION", "dense")
+
+
+def write_faqs(path, faqs):
+    path.write_text(json.dumps(faqs))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_saved_index_is_reused_across_loads(tmp_path, dtype):
+    faq_path = tmp_path / "faq.json"
+    write_faqs(faq_path, FAQS)
+    encoder = HashEncoder()
+    index = FAQIndex(encoder, "test-model", faq_path=str(faq_path), dtype=dtype)
+    assert len(encoder.encoded) == 3
+    assert isinstance(index.snapshot.matrix, QuantizedMatrix) == (dtype != "float32")
+
+    second_encoder = HashEncoder()
+    reloaded = FAQIndex(second_encoder, "test-model", faq_path=str(faq_path), dtype=dtype)
+    assert second_encoder.encoded == []
+    assert reloaded.snapshot.faq_hash == index.snapshot.faq_hash
+    assert np.allclose(np.asarray(reloaded.snapshot.matrix), np.asarray(index.snapshot.matrix))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_questions_find_their_own_answer(tmp_path, dtype):
+    faq_path = tmp_path / "faq.json"
+    write_faqs(faq_path, FAQS)
+    index = FAQIndex(HashEncoder(), "test-model", faq_path=str(faq_path), dtype=dtype)
+    for category, qa_pairs in FAQS.items():
+        for qa in qa_pairs:
+            best, similarity = index.snapshot.best_match(index.encode_query(qa["question"]), category)
+            assert best["answer"] == qa["answer"]
+            assert similarity > 0.95
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_reload_embeds_only_new_questions(tmp_path, dtype):
+    faq_path = tmp_path / "faq.json"
+    write_faqs(faq_path, FAQS)
+    encoder = HashEncoder()
+    index = FAQIndex(encoder, "test-model", faq_path=str(faq_path), dtype=dtype)
+    old_snapshot = index.snapshot
+
+    assert index.reload() == {"reloaded": False, "version": old_snapshot.faq_hash}
+
+    edited = json.loads(json.dumps(FAQS))
+    edited["technical"].append({"question": "The app crashes on start", "answer": "Clear the cache."})
+    del edited["billing"][1]
+    write_faqs(faq_path, edited)
+    encoder.encoded.clear()
+    stats = index.reload()
+
+    assert encoder.encoded == ["The app crashes on start"]
+    assert stats["reloaded"] and stats["embedded"] == 1 and stats["removed"] == 1
+    assert stats["entries"] == 3
+    assert index.snapshot is not old_snapshot
+    # Queries in flight keep the snapshot they started with
+    assert len(old_snapshot.items) == 3
+    assert index.snapshot.is_answer("Clear the cache.")
+    assert not index.snapshot.is_answer("On the day you signed up.")
+
+
+def test_unreadable_matrix_is_rebuilt(tmp_path):
+    faq_path = tmp_path / "faq.json"
+    write_faqs(faq_path, FAQS)
+    index = FAQIndex(HashEncoder(), "test-model", faq_path=str(faq_path))
+    with open(index.matrix_path, "wb") as f:
+        f.write(b"not a matrix")
+
+    encoder = HashEncoder()
+    rebuilt = FAQIndex(encoder, "test-model", faq_path=str(faq_path))
+    assert len(encoder.encoded) == 3
+    assert len(rebuilt.snapshot.matrix) == 3
+
+
+def test_lexical_match_needs_no_encoder(tmp_path):
+    faq_path = tmp_path / "faq.json"
+    write_faqs(faq_path, FAQS)
+    encoder = HashEncoder()
+    index = FAQIndex(encoder, "test-model", faq_path=str(faq_path))
+    encoder.encoded.clear()
+    best, _ = index.snapshot.lexical_match("change my payment", "billing")
+    assert best["answer"] == "Go to Billing > Payment Methods."
+    assert index.snapshot.lexical_match("hello", "billing") == (None, 0.0)
+    assert encoder.encoded == []
@@ -0,0 +1,52 @@
+import random
+
+from keyword_matcher import KeywordMatcher
+
+KEYWORDS = {
+    "billing": ["payment", "payment method", "bill", "refund", "credit card"],
+    "technical": ["password", "login", "log", "error", "two factor"],
+    "general": ["help", "hours", "business hours", "about"],
+}
+
+
+def substring_scores(text):
+    # What the original per-keyword `keyword in text` loop computed
+    text = text.lower()
+    return {label: sum(1 for keyword in keywords if keyword in text) for label, keywords in KEYWORDS.items()}
+
+
+def test_scores_match_a_substring_check_per_keyword():
+    matcher = KeywordMatcher(KEYWORDS)
+    words = ["payment", "method", "billing", "login", "password", "two", "factor", "hours", "business",
+             "help", "helpful", "about", "error", "refunds", "credit", "card", "the", "my", "Payment"]
+    rng = random.Random(0)
+    for _ in range(500):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 8)))
+        assert matcher.score(text) == substring_scores(text), text
+
+
+def test_iter_matches_reports_every_occurrence():
+    matcher = KeywordMatcher({"k": ["log", "login", "in"]})
+    text = "login log in"
+    found = sorted((start, end, text[start:end]) for start, end, _ in matcher.iter_matches(text))
+    expected = sorted((i, i + len(keyword), keyword)
+                      for keyword in ("log", "login", "in")
+                      for i in range(len(text)) if text.startswith(keyword, i))
+    assert found == expected
+
+
+def test_word_boundary_matches_whole_words_only():
+    matcher = KeywordMatcher({"k": ["bill"]}, word_boundary=True)
+    assert matcher.score("my bill")["k"] == 1
+    assert matcher.score("billing")["k"] == 0
+
+
+def test_word_start_allows_suffixes_but_not_prefixes():
+    matcher = KeywordMatcher({"k": ["hate"]}, word_start=["k"])
+    assert matcher.score("hateful")["k"] == 1
+    assert matcher.score("whatever")["k"] == 0
+
+
+def test_weights_count_once_per_keyword():
+    matcher = KeywordMatcher({"k": [("refund", 3)]})
+    assert matcher.score("refund refund")["k"] == 3
@@ -0,0 +1,87 @@
+import numpy as np
+
+from response_cache import ExactCache, ResponseCache, ReviewMemo, SemanticCache, normalize_query
+
+
+def unit(values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_normalize_query_ignores_case_and_punctuation():
+    assert normalize_query("How do I reset  password?") == normalize_query("how do i reset password")
+
+
+def test_exact_cache_evicts_least_recently_used():
+    cache = ExactCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_exact_cache_expires_entries():
+    cache = ExactCache(ttl=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert "a" not in cache.entries
+
+
+def test_semantic_cache_hits_only_above_threshold():
+    cache = SemanticCache(max_size=4, threshold=0.9)
+    cache.put(unit([1, 0, 0]), "first")
+    assert cache.get(unit([1, 0.1, 0])) == "first"
+    assert cache.get(unit([0, 1, 0])) is None
+
+
+def test_semantic_cache_reuses_the_least_recently_used_slot():
+    cache = SemanticCache(max_size=2, threshold=0.99)
+    cache.put(unit([1, 0, 0]), "x")
+    cache.put(unit([0, 1, 0]), "y")
+    cache.get(unit([1, 0, 0]))
+    cache.put(unit([0, 0, 1]), "z")
+    assert cache.get(unit([0, 1, 0])) is None
+    assert cache.get(unit([1, 0, 0])) == "x"
+    assert cache.get(unit([0, 0, 1])) == "z"
+
+
+def test_response_cache_drops_entries_when_the_version_changes():
+    cache = ResponseCache(semantic_size=4, semantic_threshold=0.9)
+    cache.sync_version("v1")
+    cache.put("key", unit([1, 0]), {"response": "r"}, "v1")
+    assert cache.get_exact("key") == {"response": "r"}
+    cache.sync_version("v2")
+    assert cache.get_exact("key") is None
+    assert cache.get_semantic(unit([1, 0])) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_response_cache_ignores_results_from_an_old_version():
+    cache = ResponseCache()
+    cache.sync_version("v2")
+    cache.put("key", None, {"response": "stale"}, "v1")
+    assert cache.get_exact("key") is None
+
+
+def test_review_memo_reviews_each_answer_once_per_context():
+    memo = ReviewMemo()
+    calls = []
+
+    def review(text):
+        calls.append(text)
+        return text.upper()
+
+    assert memo.get_or_review("answer", lambda: review("answer"), ("billing",)) == "ANSWER"
+    assert memo.get_or_review("answer", lambda: review("answer"), ("billing",)) == "ANSWER"
+    assert memo.get_or_review("answer", lambda: review("answer"), ("general",)) == "ANSWER"
+    assert calls == ["answer", "answer"]
+    assert memo.stats() == {"hits": 1, "misses": 2, "size": 2}
+
+
+def test_review_memo_is_bounded():
+    memo = ReviewMemo(max_size=2)
+    for answer in ("a", "b", "c"):
+        memo.get_or_review(answer, lambda: answer)
+    assert memo.stats()["size"] == 2
@@ -0,0 +1,22 @@
+from simple_agents import SimpleReviewAgent
+
+
+def test_negative_phrases_are_redacted_in_any_case():
+    reviewed = SimpleReviewAgent().review_response("", "general", "That was a Stupid question. Thank you.")
+    assert reviewed == "That was a [redacted] question. Thank you."
+
+
+def test_inflected_forms_of_negative_phrases_are_redacted():
+    reviewed = SimpleReviewAgent().review_response("", "general", "Stupidity, hateful idiots. Thank you.")
+    assert reviewed == "[redacted]ity, [redacted]ful [redacted]s. Thank you."
+
+
+def test_words_containing_a_negative_phrase_are_kept():
+    reviewed = SimpleReviewAgent().review_response("", "general", "Pick whatever plan suits you. Thank you.")
+    assert reviewed == "Pick whatever plan suits you. Thank you."
+
+
+def test_closings_still_match_inside_words():
+    # "pleased" counts as a closing, as with the original substring check
+    reviewed = SimpleReviewAgent().review_response("", "general", "We are pleased to help.")
+    assert reviewed == "We are pleased to help."
@@ -0,0 +1,34 @@
+import importlib
+
+import pytest
+
+from lexical_index import tokenize
+
+pytest.importorskip("streamlit")
+
+
+@pytest.fixture(scope="module")
+def response_agent(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("CHAT_HISTORY_PATH", str(tmp_path_factory.mktemp("ui") / "history.sqlite3"))
+        simple_ui = importlib.import_module("simple_ui")
+    return simple_ui.SimpleResponseAgent()
+
+
+def test_single_keywords_of_the_original_matcher_still_match(response_agent):
+    # The original matcher answered any query containing a question word longer than four letters
+    for category, faqs in response_agent.knowledge_base.items():
+        for faq in faqs:
+            for word in tokenize(faq["question"]):
+                if len(word) > 4:
+                    assert response_agent.generate_response(word, category) == faq["answer"], word
+
+
+def test_one_distinctive_word_matches(response_agent):
+    answer = response_agent.knowledge_base["billing"][0]["answer"]
+    assert response_agent.generate_response("change payment", "billing") == answer
+
+
+def test_short_common_words_get_the_default(response_agent):
+    assert response_agent.generate_response("the app", "technical").startswith("For technical support")
+    assert response_agent.generate_response("I need help", "general").startswith("Thank you for your inquiry")
@@ -1,12 +1,16 @@
 import streamlit as st
-import requests
-import time
 import sys
 import os
 
 # Add the current directory to the path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from api_client import SupportAPIClient
+from chat_history import ChatHistory, render_history
+
+# Messages drawn on each rerun; older ones are shown on request
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "20"))
+
 # Set page configuration
 st.set_page_config(
     page_title="Customer Support System",
@@ -119,12 +123,18 @@ class SimpleReviewAgent:
             
         return response
 
-# Initialize the simple agents
-classifier = SimpleClassifierAgent()
-response_agent = SimpleResponseAgent()
-review_agent = SimpleReviewAgent()
+@st.cache_resource
+def local_agents():
+    # Built once per server process, not on every rerun
+    return SimpleClassifierAgent(), SimpleResponseAgent(), SimpleReviewAgent()
+
+@st.cache_resource
+def api_client():
+    # Shared by every session, so its connections and circuit state are too
+    return SupportAPIClient()
 
 def process_query_simple(query):
+    classifier, response_agent, review_agent = local_agents()
     category = classifier.classify_query(query)
     draft_response = response_agent.generate_response(query, category)
     final_response = review_agent.review_response(query, category, draft_response)
@@ -134,15 +144,29 @@ def process_query_simple(query):
         "response": final_response
     }
 
+def stream_query_api(query, placeholder):
+    # Render draft and reviewed tokens as they arrive; returns the final result,
+    # or None if the API can't be used. While the API's circuit is open this
+    # returns at once, so the local agents answer without waiting for a timeout.
+    text = ""
+    stage = None
+    # Leave the API time to fall back to a cheaper answer before our read timeout
+    for event, data in api_client().stream_query(query, deadline_ms=4000):
+        if event in ("draft", "final"):
+            # Reviewed tokens replace the draft once they start arriving
+            if event != stage:
+                stage = event
+                text = ""
+            text += data
+            placeholder.markdown(text + "▌")
+        elif event == "done":
+            return data
+    return None
+
 st.title("🤖 Multi-Agent Customer Support System")
 st.write("This system uses multiple AI agents to classify, respond to, and review customer support queries.")
 
-# Initialize chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-# Display chat messages from history on app rerun
-for message in st.session_state.messages:
+def render_message(message):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if message["role"] == "assistant" and "category" in message:
@@ -150,6 +174,15 @@ for message in st.session_state.messages:
             st.markdown(f'<span class="category-badge {badge_class}">Category: {message["category"]}</span>', 
                        unsafe_allow_html=True)
 
+# Initialize chat history; only recent messages are kept in memory
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistory()
+history = st.session_state.history
+# Messages past the age cap move to disk even when nothing new is sent
+history.spill()
+
+render_history(st, history, CHAT_WINDOW, render_message)
+
 # React to user input
 if prompt := st.chat_input("What can I help you with today?"):
     # Display user message in chat message container
@@ -157,40 +190,29 @@ if prompt := st.chat_input("What can I help you with today?"):
         st.markdown(prompt)
     
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history.append({"role": "user", "content": prompt})
     
-    # Process the query
-    with st.spinner('Processing your query with our multi-agent system...'):
-        try:
-            # Try to use the API first
-            response = requests.post(
-                "http://localhost:8000/support/query",
-                json={"query": prompt},
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-            else:
-                # Fallback to simple processing
-                result = process_query_simple(prompt)
-        except:
+    # Process the query, streaming tokens into the assistant message
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        # Try to use the API first
+        result = stream_query_api(prompt, placeholder)
+        
+        if result is None:
             # Fallback to simple processing if API is not available
             result = process_query_simple(prompt)
         
-        # Display assistant response in chat message container
-        with st.chat_message("assistant"):
-            st.markdown(result["response"])
-            badge_class = f"{result['category']}-badge"
-            st.markdown(f'<span class="category-badge {badge_class}">Category: {result["category"]}</span>', 
-                       unsafe_allow_html=True)
-        
-        # Add assistant response to chat history
-        st.session_state.messages.append({
-            "role": "assistant", 
-            "content": result["response"],
-            "category": result["category"]
-        })
+        placeholder.markdown(result["response"])
+        badge_class = f"{result['category']}-badge"
+        st.markdown(f'<span class="category-badge {badge_class}">Category: {result["category"]}</span>', 
+                   unsafe_allow_html=True)
+    
+    # Add assistant response to chat history
+    history.append({
+        "role": "assistant", 
+        "content": result["response"],
+        "category": result["category"]
+    })
 
 # Add sidebar with information
 with st.sidebar:
@@ -209,5 +231,5 @@ with st.sidebar:
     """)
     
     if st.button("Clear Conversation"):
-        st.session_state.messages = []
+        history.clear()
         st.rerun()
\ No newline at end of file
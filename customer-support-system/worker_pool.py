@@ -0,0 +1,350 @@
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+# Inside a directory only this user can enter, rather than in /tmp itself
+DEFAULT_INFERENCE_SOCKET = os.path.join(tempfile.gettempdir(), f"support-inference-{os.getuid()}", "inference.sock")
+
+# Support system owned by this process: shared by all threads in thread mode,
+# or one per worker process in process mode
+_worker_system = None
+
+
+def init_worker_system(use_simple, warm_up=False, ready_counter=None):
+    global _worker_system
+    from app import CustomerSupportSystem
+    system = CustomerSupportSystem(use_simple=use_simple)
+    if warm_up:
+        system.warm_up()
+    watch_interval = float(os.getenv("KB_WATCH_INTERVAL", "0"))
+    if watch_interval > 0:
+        system.watch_knowledge_base(watch_interval)
+    _worker_system = system
+    if ready_counter is not None:
+        with ready_counter.get_lock():
+            ready_counter.value += 1
+
+
+def call_worker_system(method, *args, **kwargs):
+    return getattr(_worker_system, method)(*args, **kwargs)
+
+
+def stream_worker_system(channel, stop, method, *args, **kwargs):
+    # Forwards each item of a generator method to the channel, ending with None.
+    # Once stop is set nobody is reading, so the generator is closed, which
+    # stops its generation.
+    try:
+        if stop.is_set():
+            return
+        with contextlib.closing(getattr(_worker_system, method)(*args, **kwargs)) as items:
+            for item in items:
+                if stop.is_set():
+                    break
+                channel.put(item)
+    finally:
+        channel.put(None)
+
+
+def ping_worker():
+    return os.getpid()
+
+
+def inference_key_path(address):
+    return address + ".key"
+
+
+def inference_authkey(address):
+    # Shared secret for the inference socket: SUPPORT_INFERENCE_AUTHKEY if set,
+    # otherwise the key file the server writes next to the socket. Both ends
+    # prove they hold it before anything is unpickled.
+    key = os.getenv("SUPPORT_INFERENCE_AUTHKEY")
+    if key:
+        return key.encode("utf-8")
+    with open(inference_key_path(address), "rb") as f:
+        if os.fstat(f.fileno()).st_uid != os.getuid():
+            raise PermissionError(f"{inference_key_path(address)} is not owned by this user")
+        return f.read()
+
+
+def connect_inference(address):
+    try:
+        return Client(address, family="AF_UNIX", authkey=inference_authkey(address))
+    except AuthenticationError as e:
+        # Treated like a server that is down, so callers retry and report not ready
+        raise ConnectionRefusedError(f"Inference server at {address} failed authentication: {e}") from e
+
+
+# In remote mode every pool thread keeps its own connection to the inference server
+_remote = threading.local()
+
+
+def remote_request(address, kind, method=None, *args, **kwargs):
+    # Sends one request and returns the connection for reading the reply; a
+    # broken connection is dropped so the next request reconnects
+    connection = getattr(_remote, "connection", None)
+    try:
+        if connection is None:
+            connection = _remote.connection = connect_inference(address)
+        connection.send((kind, method, args, kwargs))
+        return connection
+    except (EOFError, OSError):
+        _remote.connection = None
+        raise
+
+
+def remote_reply(connection):
+    try:
+        return connection.recv()
+    except (EOFError, OSError):
+        _remote.connection = None
+        raise
+
+
+def call_remote_system(address, retry_after, method, *args, **kwargs):
+    status, value = remote_reply(remote_request(address, "call", method, *args, **kwargs))
+    if status == "not_ready":
+        raise PoolNotReadyError(retry_after)
+    if status == "error":
+        raise RuntimeError(value)
+    return value
+
+
+def stream_remote_system(address, retry_after, channel, stop, method, *args, **kwargs):
+    try:
+        connection = remote_request(address, "stream", method, *args, **kwargs)
+        while True:
+            status, value = remote_reply(connection)
+            if stop.is_set():
+                # Closing the connection makes the server's next send fail,
+                # which closes its generator
+                connection.close()
+                _remote.connection = None
+                return
+            if status == "item":
+                channel.put(value)
+            elif status == "end":
+                return
+            elif status == "not_ready":
+                raise PoolNotReadyError(retry_after)
+            else:
+                raise RuntimeError(value)
+    finally:
+        channel.put(None)
+
+
+def remote_status(address):
+    # Uses a short-lived connection so it never competes with request threads
+    with connect_inference(address) as connection:
+        connection.send(("status", None, (), {}))
+        return connection.recv()[1]
+
+
+class PoolSaturatedError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Support pipeline is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PoolNotReadyError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Support pipeline is still loading, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PoolReservation:
+    # One admitted request's slot in the pool; releasing it more than once is a no-op
+    def __init__(self, pool):
+        self.pool = pool
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.pool.pending -= 1
+
+
+class PipelinePool:
+    def __init__(self, mode="thread", workers=None, queue_size=None, retry_after=1, use_simple=True,
+                 inference_socket=DEFAULT_INFERENCE_SOCKET):
+        # "remote" forwards requests to a separate inference_server.py process,
+        # so any number of API workers share a single copy of the models
+        if mode not in ("thread", "process", "remote"):
+            raise ValueError(f"Unknown pool mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        # Requests beyond the running ones wait in a queue of this size, the rest are rejected
+        self.queue_size = self.workers * 2 if queue_size is None else queue_size
+        self.retry_after = retry_after
+        self.use_simple = use_simple
+        self.inference_socket = inference_socket
+        self.pending = 0
+        self.executor = None
+        # Threads that wait on stream channels for the event loop, one per
+        # request the pool admits, so streams still queued for a worker can't
+        # hold up the tokens of running ones
+        self.relay_executor = None
+        self.load_error = None
+        self._thread_ready = threading.Event()
+        self._ready_counter = None
+        self._stream_manager = None
+
+    @classmethod
+    def from_env(cls):
+        workers = os.getenv("SUPPORT_WORKERS")
+        queue_size = os.getenv("SUPPORT_QUEUE_SIZE")
+        return cls(
+            mode=os.getenv("SUPPORT_POOL_MODE", "thread"),
+            workers=int(workers) if workers else None,
+            queue_size=int(queue_size) if queue_size else None,
+            retry_after=int(os.getenv("SUPPORT_RETRY_AFTER", "1")),
+            use_simple=os.getenv("SUPPORT_USE_SIMPLE", "1") != "0",
+            inference_socket=os.getenv("SUPPORT_INFERENCE_SOCKET", DEFAULT_INFERENCE_SOCKET)
+        )
+
+    def start(self):
+        # Loads and warms the models in the background and returns immediately,
+        # so the server can bind and answer liveness checks while they load
+        self.relay_executor = ThreadPoolExecutor(max_workers=self.capacity, thread_name_prefix="support-relay")
+        if self.mode == "process":
+            # Spawn so workers don't inherit the parent's threads or model state
+            context = multiprocessing.get_context("spawn")
+            self._ready_counter = context.Value("i", 0)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=init_worker_system,
+                initargs=(self.use_simple, True, self._ready_counter)
+            )
+            # Workers are started on demand, so give each one a task to start it now.
+            # A worker whose initializer fails breaks the pool and fails these tasks.
+            for _ in range(self.workers):
+                self.executor.submit(ping_worker).add_done_callback(self._check_worker_start)
+            # Worker processes can only reach a streaming queue through a manager
+            self._stream_manager = context.Manager()
+        elif self.mode == "remote":
+            # Threads here only wait on the socket, the models live in the server
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="support-client")
+            threading.Thread(target=self._watch_remote_system, name="support-watcher", daemon=True).start()
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="support-worker")
+            threading.Thread(target=self._load_thread_system, name="support-loader", daemon=True).start()
+
+    def _load_thread_system(self):
+        try:
+            init_worker_system(self.use_simple, warm_up=True)
+            self._thread_ready.set()
+        except Exception as e:
+            print(f"Error loading support system: {e}")
+            self.load_error = str(e)
+
+    def _check_worker_start(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            # The worker's own traceback goes to its stderr; the pool only sees it die
+            self.load_error = f"A worker process failed to start: {future.exception()}"
+
+    def _watch_remote_system(self, interval=1.0):
+        # Tracks whether the inference server is up and has finished loading
+        while True:
+            try:
+                status = remote_status(self.inference_socket)
+                self.load_error = status["error"]
+                if status["ready"]:
+                    self._thread_ready.set()
+                else:
+                    self._thread_ready.clear()
+            except (EOFError, OSError):
+                self._thread_ready.clear()
+            time.sleep(interval)
+
+    def _worker_call(self, method, *args, **kwargs):
+        if self.mode == "remote":
+            return functools.partial(call_remote_system, self.inference_socket, self.retry_after, method, *args, **kwargs)
+        return functools.partial(call_worker_system, method, *args, **kwargs)
+
+    def _worker_stream(self, channel, stop, method, *args, **kwargs):
+        if self.mode == "remote":
+            return functools.partial(stream_remote_system, self.inference_socket, self.retry_after, channel, stop,
+                                     method, *args, **kwargs)
+        return functools.partial(stream_worker_system, channel, stop, method, *args, **kwargs)
+
+    @property
+    def ready(self):
+        if self.mode == "process":
+            return self._ready_counter is not None and self._ready_counter.value >= self.workers
+        return self._thread_ready.is_set()
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def check_available(self):
+        if not self.ready:
+            raise PoolNotReadyError(self.retry_after)
+        # Only touched from the event loop thread, so a plain counter is enough
+        if self.pending >= self.capacity:
+            raise PoolSaturatedError(self.retry_after)
+
+    def reserve(self):
+        # Checks and takes a slot in one step, so concurrent requests can't
+        # all pass the check before any of them is counted
+        self.check_available()
+        self.pending += 1
+        return PoolReservation(self)
+
+    async def run(self, method, *args, **kwargs):
+        reservation = self.reserve()
+        try:
+            loop = asyncio.get_running_loop()
+            call = self._worker_call(method, *args, **kwargs)
+            return await loop.run_in_executor(self.executor, call)
+        finally:
+            reservation.release()
+
+    async def stream(self, reservation, method, *args, **kwargs):
+        # Async iterator over the items of a generator method run in the pool.
+        # Take the reservation with reserve() before responding, so a busy pool
+        # rejects the request with a status code; the slot is released when
+        # the stream ends. If the reader stops early, e.g. because the client
+        # disconnected, the worker is told to stop generating.
+        stop = None
+        finished = False
+        try:
+            loop = asyncio.get_running_loop()
+            if self.mode == "process":
+                channel = self._stream_manager.Queue()
+                stop = self._stream_manager.Event()
+            else:
+                channel = queue.Queue()
+                stop = threading.Event()
+
+            call = self._worker_stream(channel, stop, method, *args, **kwargs)
+            future = loop.run_in_executor(self.executor, call)
+            while True:
+                item = await loop.run_in_executor(self.relay_executor, channel.get)
+                if item is None:
+                    break
+                yield item
+            finished = True
+            # Surface any error raised by the generator
+            await future
+        finally:
+            if stop is not None and not finished:
+                stop.set()
+            reservation.release()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.relay_executor is not None:
+            self.relay_executor.shutdown(wait=False, cancel_futures=True)
+        if self._stream_manager is not None:
+            self._stream_manager.shutdown()